@@ -1,5 +1,10 @@
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import (
+    APITestCase,
+    APITransactionTestCase,
+    APIClient,
+)
 from django.conf import settings
+from django.core.cache import cache
 
 
 class APIClient(APIClient):
@@ -11,3 +16,23 @@ class APIClient(APIClient):
 
 class APITestCase(APITestCase):
     client_class = APIClient
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Cached counts, tiles and permissions would otherwise outlive
+        # rolled-back test data
+        cache.clear()
+
+
+class APITransactionTestCase(APITransactionTestCase):
+    """
+    For tests that need data to be visible to other threads (and their
+    database connections)
+    """
+
+    client_class = APIClient
+    available_apps = ["tests.rest_app"]
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        cache.clear()
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+from django.conf import settings
+
+
+if settings.WITH_GIS:
+    import django.contrib.gis.db.models.fields
+
+    class Migration(migrations.Migration):
+
+        dependencies = [
+            ("gis_app", "0001_initial"),
+        ]
+
+        operations = [
+            migrations.CreateModel(
+                name="GeoJSONModel",
+                fields=[
+                    (
+                        "id",
+                        models.AutoField(
+                            auto_created=True,
+                            primary_key=True,
+                            serialize=False,
+                            verbose_name="ID",
+                        ),
+                    ),
+                    ("name", models.CharField(max_length=255)),
+                    (
+                        "geometry",
+                        django.contrib.gis.db.models.fields.GeometryField(
+                            srid=4326
+                        ),
+                    ),
+                ],
+                options={
+                    "abstract": False,
+                },
+            ),
+        ]
+else:
+    Migration = None
@@ -13,6 +13,11 @@ if settings.WITH_GIS:
         name = models.CharField(max_length=255)
         geometry = models.PointField(srid=4326)
 
+    class GeoJSONModel(LabelModel):
+        name = models.CharField(max_length=255)
+        geometry = models.GeometryField(srid=4326)
+
 else:
     GeometryModel = None
     PointModel = None
+    GeoJSONModel = None
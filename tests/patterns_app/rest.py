@@ -67,3 +67,14 @@ class EntitySerializer(rest.ModelSerializer):
                 "control": {"appearance": "eav-fieldset-array"},
             },
         }
+
+
+class BulkEntitySerializer(EntitySerializer):
+    """
+    Writes values in bulk (without calling save() or model signals)
+    """
+
+    class Meta(EntitySerializer.Meta):
+        model = Entity
+        fields = "__all__"
+        wq_bulk_nested_arrays = True
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rest_app", "0002_cachedcountmodel_estimatedcountmodel_hasnextmodel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="KeysetModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.SlugField()),
+                ("name", models.CharField(max_length=255)),
+            ],
+        ),
+    ]
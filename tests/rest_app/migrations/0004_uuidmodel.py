@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:16
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rest_app", "0003_keysetmodel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UUIDModel",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4, primary_key=True, serialize=False
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
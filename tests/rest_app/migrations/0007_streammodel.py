@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rest_app", "0006_syncmodel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StreamModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=10)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
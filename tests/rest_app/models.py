@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from wq.db.rest.models import LabelModel
 import time
+import uuid
 
 
 class RootModel(LabelModel):
@@ -184,3 +185,38 @@ class FieldsetModel(LabelModel):
     # Address
     address = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
+
+
+class SyncModel(models.Model):
+    user = models.ForeignKey("auth.User", models.CASCADE)
+
+
+class UUIDModel(LabelModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    name = models.CharField(max_length=255)
+
+
+class KeysetModel(models.Model):
+    code = models.SlugField()
+    name = models.CharField(max_length=255)
+
+
+class KeysetDateModel(models.Model):
+    name = models.CharField(max_length=255)
+    date = models.DateTimeField()
+
+
+class CachedCountModel(models.Model):
+    name = models.CharField(max_length=10)
+
+
+class HasNextModel(models.Model):
+    name = models.CharField(max_length=10)
+
+
+class EstimatedCountModel(models.Model):
+    name = models.CharField(max_length=10)
+
+
+class StreamModel(LabelModel):
+    name = models.CharField(max_length=10)
@@ -17,6 +17,14 @@ from .models import (
     CharFieldModel,
     ExpensiveModel,
     FieldsetModel,
+    SyncModel,
+    UUIDModel,
+    KeysetModel,
+    KeysetDateModel,
+    CachedCountModel,
+    HasNextModel,
+    EstimatedCountModel,
+    StreamModel,
 )
 from .serializers import (
     RootModelSerializer,
@@ -118,6 +126,55 @@ rest.router.register_model(
     serializer=FieldsetSerializer,
 )
 
+rest.router.register_model(
+    SyncModel,
+    fields="__all__",
+    cache="autoupdate",
+    cache_filter=cache_users_own_data,
+    sync=True,
+)
+rest.router.register_model(
+    UUIDModel,
+    fields="__all__",
+    cache="autoupdate",
+    cache_filter=lambda qs, req: qs,
+    sync=True,
+)
+rest.router.register_model(
+    KeysetModel,
+    lookup="code",
+    fields="__all__",
+    queryset=KeysetModel.objects.order_by("-name"),
+    pagination="keyset",
+)
+rest.router.register_model(
+    KeysetDateModel,
+    fields="__all__",
+    queryset=KeysetDateModel.objects.order_by("-date"),
+    pagination="keyset",
+)
+rest.router.register_model(
+    CachedCountModel,
+    fields="__all__",
+    count="cached",
+)
+rest.router.register_model(
+    HasNextModel,
+    fields="__all__",
+    count="has_next",
+)
+rest.router.register_model(
+    EstimatedCountModel,
+    fields="__all__",
+    count="estimate",
+)
+rest.router.register_model(
+    StreamModel,
+    fields="__all__",
+    cache="all",
+    stream=True,
+)
+
 rest.router.add_page("rest_context", {})
 rest.router.add_page("auth_context", {})
 rest.router.add_page("script_context", {})
@@ -38,6 +38,7 @@ INSTALLED_APPS = (
     "django.contrib.auth",
     "wq.db.rest",
     "wq.db.rest.auth",
+    "wq.db.rest.sync",
     "tests.rest_app",
     "tests.conflict_app",
     "tests.patterns_app",
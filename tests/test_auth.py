@@ -1,7 +1,10 @@
 from .base import APITestCase
 import json
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Group, Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from wq.db import rest
 
 
 class AuthTestCase(APITestCase):
@@ -18,3 +21,42 @@ class AuthTestCase(APITestCase):
         response = self.client.get("/login.json")
         result = json.loads(response.content.decode("utf-8"))
         self.assertTrue("user" in result)
+
+    def test_auth_config_hash(self):
+        response = self.client.get("/login.json")
+        config_hash = response.data["config_hash"]
+        self.assertIn("config", response.data)
+
+        response = self.client.get("/login.json?config_hash=" + config_hash)
+        self.assertEqual(response.data["config_hash"], config_hash)
+        self.assertNotIn("config", response.data)
+
+    def test_auth_user_config_cache(self):
+        def get_perm(codename):
+            return Permission.objects.get(
+                content_type__app_label="rest_app", codename=codename
+            )
+
+        def get_user_config():
+            user = User.objects.get(pk=self.user.pk)
+            with CaptureQueriesContext(connection) as queries:
+                config = rest.router.get_user_config(user)
+            return config["pages"]["item"], len(queries)
+
+        get_user_config()
+        perms, query_count = get_user_config()
+        self.assertEqual(perms, {})
+        self.assertEqual(query_count, 0)
+
+        # User permissions
+        self.user.user_permissions.add(get_perm("add_item"))
+        perms, query_count = get_user_config()
+        self.assertEqual(perms, {"can_add": True})
+        self.assertGreater(query_count, 0)
+
+        # Group permissions
+        group = Group.objects.create(name="Editors")
+        self.user.groups.add(group)
+        group.permissions.add(get_perm("change_item"))
+        perms, query_count = get_user_config()
+        self.assertEqual(perms, {"can_add": True, "can_change": True})
@@ -1,5 +1,6 @@
 from .base import APITestCase
 from django.core.management import call_command
+from wq.db import rest
 
 try:
     from StringIO import StringIO
@@ -33,3 +34,20 @@ class CommandTestCase(APITestCase):
         text = text.replace("define(", "")
         text = text.replace(");", "")
         self.check_config(text)
+
+    def test_dump_config_cached(self):
+        text = rest.router.get_config_text("esm")
+        self.assertIs(text, rest.router.get_config_text("esm"))
+        f = StringIO()
+        call_command("dump_config", format="esm", stdout=f)
+        self.assertEqual(f.getvalue().strip(), text)
+
+        response = self.client.get("/config.json")
+        content, etag = rest.router._encoded_config[
+            (type(response.accepted_renderer), response.accepted_media_type)
+        ]
+        self.assertEqual(response.content, content)
+
+        rest.router.set_extra_config()
+        self.assertIsNot(text, rest.router.get_config_text("esm"))
+        self.assertEqual(text, rest.router.get_config_text("esm"))
@@ -1,7 +1,9 @@
 import unittest
 from .base import APITestCase
+from wq.db import rest
 import json
 from django.conf import settings
+from django.test import override_settings
 
 
 class ConfigTestCase(APITestCase):
@@ -315,3 +317,38 @@ class ConfigTestCase(APITestCase):
             ],
             conf["form"],
         )
+
+    @override_settings(DEBUG=False)
+    def test_rest_config_etag(self):
+        rest.router.invalidate_page_config()
+        self.addCleanup(rest.router.invalidate_page_config)
+        etags = {}
+        for ext in "json", "js":
+            url = "/config.%s" % ext
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            self.assertNotIn("Last-Modified", response)
+            etag = response["ETag"]
+            etags[ext] = etag
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response["ETag"], etag)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+            self.assertEqual(response.status_code, 200)
+
+            # ETag is derived from content
+            rest.router.invalidate_page_config()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        self.assertNotEqual(etags["json"], etags["js"])
+
+        with self.settings(WQ_CONFIG_MAX_AGE=300):
+            response = self.client.get("/config.json")
+            self.assertEqual(
+                response["Cache-Control"], "public, max-age=300"
+            )
@@ -2,7 +2,12 @@ from wq.db import rest
 from .base import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
 from tests.patterns_app.models import Campaign, Entity, Attribute
+from tests.patterns_app.rest import BulkEntitySerializer
+from rest_framework.exceptions import ValidationError
 
 
 class CustomPatternTestCase(APITestCase):
@@ -243,3 +248,90 @@ class CustomPatternTestCase(APITestCase):
         self.assertEqual(self.entity1.name, "Test'")
         self.assertEqual(self.entity1.values.count(), 1)
         self.assertEqual(self.entity1.values.first().attribute, self.att3)
+
+    def bulk_update(self, data):
+        serializer = BulkEntitySerializer(
+            self.entity1,
+            data=data,
+            context={"request": None, "router": rest.router},
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.data
+
+    def test_eav_put_bulk(self):
+        values = [
+            self.entity1.values.create(attribute=self.att1, value="1"),
+            self.entity1.values.create(attribute=self.att2, value="2"),
+        ]
+        form = {
+            "name": "Test",
+            "campaign_id": self.campaign1.slug,
+            "values": [
+                {"id": values[0].pk, "attribute_id": self.att1.pk, "value": 3},
+                {"attribute_id": self.att2.pk, "value": "4"},
+                {"attribute_id": self.att2.pk, "value": "5"},
+                {"attribute_id": self.att2.pk, "value": "6"},
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            data = self.bulk_update(form)
+        self.assertEqual(
+            [value["value"] for value in data["values"]],
+            ["3", "4", "5", "6"],
+        )
+        self.assertEqual(data["values"][0]["id"], values[0].pk)
+        self.assertFalse(
+            self.entity1.values.filter(pk=values[1].pk).exists()
+        )
+
+        # One statement of each kind regardless of the number of rows
+        sql = [query["sql"] for query in queries]
+        for statement in (
+            'INSERT INTO "patterns_app_value"',
+            'UPDATE "patterns_app_value"',
+            'DELETE FROM "patterns_app_value"',
+        ):
+            self.assertEqual(
+                len([s for s in sql if s.startswith(statement)]), 1, statement
+            )
+
+    def test_eav_put_bulk_fallback(self):
+        form = {
+            "name": "Test",
+            "campaign_id": self.campaign1.slug,
+            "values": [
+                {"attribute_id": self.att1.pk, "value": "1"},
+                {"attribute_id": self.att2.pk, "value": "2"},
+            ],
+        }
+        features = type(connection.features)
+        with patch.object(
+            features, "can_return_rows_from_bulk_insert", False
+        ), CaptureQueriesContext(connection) as queries:
+            data = self.bulk_update(form)
+        self.assertEqual(
+            [value["value"] for value in data["values"]], ["1", "2"]
+        )
+        self.assertTrue(all(value["id"] for value in data["values"]))
+
+        # Rows are saved one at a time
+        sql = [query["sql"] for query in queries]
+        self.assertEqual(
+            len([s for s in sql if s.startswith('INSERT INTO "patterns')]), 2
+        )
+
+    def test_eav_put_bulk_invalid(self):
+        form = {
+            "name": "Test",
+            "campaign_id": self.campaign1.slug,
+            "values": [
+                {"attribute_id": self.att1.pk, "value": "1"},
+                {"attribute_id": "invalid", "value": "2"},
+            ],
+        }
+        with self.assertRaises(ValidationError) as cm:
+            self.bulk_update(form)
+        self.assertEqual(cm.exception.detail["values"][0], {})
+        self.assertIn("attribute_id", cm.exception.detail["values"][1])
+        self.assertEqual(self.entity1.values.count(), 0)
@@ -2,8 +2,27 @@ import unittest
 from .base import APITestCase
 from rest_framework import status
 from django.conf import settings
-from .gis_app.models import GeometryModel, PointModel
-from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from .gis_app.models import GeometryModel, PointModel, GeoJSONModel
+from django.contrib.auth.models import User, AnonymousUser
+from .rest_app.models import ItemType
+from wq.db.rest.maps import (
+    supports_db_geojson,
+    get_tile_coords,
+    get_tile_bounds,
+    extent_overlaps,
+    get_tile_region,
+    get_tile_versions,
+    get_tile_visibility,
+    invalidate_tiles,
+    expand_layer_extents,
+    TILE_EXTENT_KEY,
+)
+from wq.db.rest.renderers import GeoJSONRenderer, RawGeoJSON
+from unittest.mock import patch
 import json
 
 
@@ -80,6 +99,171 @@ class GISTestCase(APITestCase):
             b'\x1a\x1e\n\npointmodel\x12\x0b\x08\x01\x18\x01"\x05\t\x86&\x84>(\x80 x\x02',
         )
 
+    @unittest.skipUnless(settings.VARIANT == "postgis", "requires postgis")
+    def test_tiles_no_cache(self):
+        response = self.client.get("/tiles/0/0/0.pbf")
+        self.assertNotIn("ETag", response)
+        PointModel.objects.create(pk=1, geometry="POINT(34 -84)")
+        response = self.client.get("/tiles/0/0/0.pbf")
+        self.assertNotEqual(response.content, b"")
+
+    @unittest.skipUnless(settings.VARIANT == "postgis", "requires postgis")
+    @override_settings(WQ_TILE_CACHE_TIMEOUT=3600)
+    def test_tiles_cache(self):
+        response = self.client.get("/tiles/0/0/0.pbf")
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "public, max-age=0")
+
+        response = self.client.get(
+            "/tiles/0/0/0.pbf", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+        PointModel.objects.create(pk=1, geometry="POINT(34 -84)")
+        response = self.client.get(
+            "/tiles/0/0/0.pbf", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertNotEqual(response.content, b"")
+
+        # Saves and deletes do not query the database again
+        point = PointModel.objects.get(pk=1)
+        point.geometry = "POINT(35 -84)"
+        with CaptureQueriesContext(connection) as queries:
+            point.save()
+        self.assertEqual(len(queries), 1)
+
+        # Updates invalidate every tile for the model
+        etag = response["ETag"]
+        response = self.client.get(
+            "/tiles/0/0/0.pbf", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @unittest.skipUnless(settings.VARIANT == "postgis", "requires postgis")
+    @override_settings(WQ_TILE_CACHE_TIMEOUT=3600)
+    def test_tiles_single_query(self):
+        PointModel.objects.create(pk=1, geometry="POINT(34 -84)")
+        GeometryModel.objects.create(pk=1, geometry="POINT(34 -84)")
+        self.client.get("/tiles/0/0/0.pbf")
+        x, y = get_tile_coords(34, -84, 6)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/tiles/6/{x}/{y}.pbf")
+        self.assertEqual(len(queries), 1)
+        self.assertIn(b"pointmodel", response.content)
+        self.assertIn(b"geometrymodel", response.content)
+
+        # Tiles outside the layer extents do not need a query
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/tiles/6/0/0.pbf")
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.content, b"")
+
+    @unittest.skipUnless(settings.VARIANT == "postgis", "requires postgis")
+    def test_tiles_no_cache_extents(self):
+        PointModel.objects.create(pk=1, geometry="POINT(34 -84)")
+        self.client.get("/tiles/0/0/0.pbf")
+
+        # Layer extents are used even without the tile cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/tiles/6/0/0.pbf")
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.content, b"")
+
+        # ... and are widened when geometries are saved outside them
+        PointModel.objects.create(pk=2, geometry="POINT(-175 85)")
+        response = self.client.get("/tiles/6/0/0.pbf")
+        self.assertIn(b"pointmodel", response.content)
+
+    def test_tile_bounds(self):
+        west, south, east, north = get_tile_bounds(0, 0, 0)
+        self.assertLess(west, -180)
+        self.assertGreater(east, 180)
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(south, -85.0511, places=4)
+
+        x, y = get_tile_coords(34, -84, 10)
+        bounds = get_tile_bounds(10, x, y)
+        self.assertTrue(extent_overlaps((34, -84, 34, -84), bounds))
+        self.assertFalse(extent_overlaps((-34, 84, -34, 84), bounds))
+        self.assertFalse(extent_overlaps(None, bounds))
+
+    def test_tile_invalidation(self):
+        # (Any model will do, as no geometry lookups are involved)
+        model = User
+        label = model._meta.label_lower
+        x, y = get_tile_coords(34, -84, 12)
+        near = get_tile_region(12, x, y)
+        far = get_tile_region(12, 0, 0)
+        overview = get_tile_region(4, 0, 0)
+
+        def versions():
+            return {
+                region: get_tile_versions([label], region)
+                for region in (near, far, overview)
+            }
+
+        initial = versions()
+        self.assertEqual(initial, versions())
+
+        invalidate_tiles(model, [(34, -84, 34, -84)])
+        updated = versions()
+        self.assertNotEqual(initial[near], updated[near])
+        self.assertNotEqual(initial[overview], updated[overview])
+        self.assertEqual(initial[far], updated[far])
+
+        # Large changes invalidate every tile
+        invalidate_tiles(model, [(-180, -85, 180, 85)])
+        final = versions()
+        self.assertNotEqual(updated[far], final[far])
+
+        # As do updates (where the previous extent is unknown)
+        invalidate_tiles(model, None)
+        self.assertNotEqual(final[far], versions()[far])
+
+    def test_tile_visibility(self):
+        from wq.db import rest
+
+        layers = [("itemtype", {}, ["id"])]
+
+        def visibility(url, user=None):
+            request = RequestFactory().get(url)
+            request.user = user or AnonymousUser()
+            return get_tile_visibility(rest.router, request, layers)
+
+        self.assertEqual(visibility("/tiles/0/0/0.pbf?a=1"), "public")
+        with patch.dict(rest.router._filters, {ItemType: lambda qs, r: qs}):
+            self.assertEqual(visibility("/tiles/0/0/0.pbf"), "anonymous")
+            self.assertEqual(
+                visibility("/tiles/0/0/0.pbf", self.user),
+                "user-%s" % self.user.pk,
+            )
+
+            # Filters may depend on the query string, which is normalized
+            self.assertEqual(
+                visibility("/tiles/0/0/0.pbf?b=2&a=1&b=1"),
+                "anonymous?a=1&b=1&b=2",
+            )
+            self.assertEqual(
+                visibility("/tiles/0/0/0.pbf?b=1&a=1&b=2", self.user),
+                "user-%s?a=1&b=1&b=2" % self.user.pk,
+            )
+
+    def test_tile_layer_extents(self):
+        model = User
+        key = TILE_EXTENT_KEY % model._meta.label_lower
+        extents = {"geometry": (30, -85, 35, -80)}
+        cache.set(key, extents, None)
+
+        # Geometries inside the cached extent keep it
+        expand_layer_extents(model, {"geometry": (34, -84, 34, -84)})
+        self.assertEqual(cache.get(key), extents)
+
+        # Geometries outside it mean the extent needs to be recomputed
+        expand_layer_extents(model, {"geometry": (-34, 84, -34, 84)})
+        self.assertIsNone(cache.get(key))
+
     @unittest.skipUnless(settings.WITH_GIS, "requires GIS")
     def test_defer_geometry(self):
         PointModel.objects.create(pk=1, geometry="POINT(34 -84)")
@@ -114,3 +298,69 @@ class GISTestCase(APITestCase):
                 }
             ],
         )
+
+    @unittest.skipUnless(supports_db_geojson(), "requires spatial database")
+    def test_db_geojson(self):
+        GeoJSONModel.objects.create(
+            pk=1, name="Test", geometry="POINT(34 -84)"
+        )
+        response = self.client.get("/geojsonmodels.geojson")
+        self.assertEqual(
+            json.loads(response.content)["features"],
+            [
+                {
+                    "id": 1,
+                    "type": "Feature",
+                    "properties": {
+                        "name": "Test",
+                        "label": "Test",
+                    },
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [34, -84],
+                    },
+                }
+            ],
+        )
+
+    @unittest.skipUnless(supports_db_geojson(), "requires spatial database")
+    def test_db_geojson_update(self):
+        GeoJSONModel.objects.create(
+            pk=1, name="Test", geometry="POINT(34 -84)"
+        )
+        response = self.client.put(
+            "/geojsonmodels/1.geojson",
+            {
+                "name": "Test",
+                "geometry": {"type": "Point", "coordinates": [35, -85]},
+            },
+            format="json",
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK, response.data
+        )
+        self.assertEqual(
+            json.loads(response.content)["geometry"],
+            {"type": "Point", "coordinates": [35, -85]},
+        )
+
+    def test_render_raw_geojson(self):
+        geometry = '{"type":"Point","coordinates":[34,-84]}'
+        content = GeoJSONRenderer().render(
+            [{"id": 1, "name": "Test", "geometry": RawGeoJSON(geometry)}]
+        )
+        self.assertIn(b'"geometry":' + geometry.encode(), content)
+        self.assertEqual(
+            json.loads(content),
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "id": 1,
+                        "properties": {"name": "Test"},
+                        "geometry": json.loads(geometry),
+                    }
+                ],
+            },
+        )
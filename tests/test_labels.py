@@ -79,3 +79,35 @@ class LabelTestCase(APITestCase):
         self.assertEqual(obj["type_id"], "id-1")
         self.assertEqual(obj["type_label"], "TEST")
         self.assertEqual(obj["label"], "Test: Test 1")
+
+    def test_label_related(self):
+        from tests.rest_app.models import (
+            RootModel,
+            OneToOneModel,
+            SlugRefParent,
+        )
+
+        self.assertEqual(RootModel.get_label_related(), [])
+        self.assertEqual(OneToOneModel.get_label_related(), ["root"])
+        self.assertEqual(SlugRefParent.get_label_related(), ["ref"])
+
+    def test_render_labels(self):
+        from wq.db.rest.models import render_labels
+        from tests.rest_app.models import SlugModel, SlugRefParent
+
+        ref = SlugModel.objects.create(code="test", name="Test")
+        for i in range(5):
+            SlugRefParent.objects.create(name="Parent %s" % i, ref=ref)
+
+        with self.assertNumQueries(1):
+            labels = render_labels(SlugRefParent.objects.order_by("pk"))
+        self.assertEqual(labels, ["Parent %s (Test)" % i for i in range(5)])
+        self.assertEqual(
+            labels, [str(obj) for obj in SlugRefParent.objects.order_by("pk")]
+        )
+
+    def test_list_labels(self):
+        from wq.db.rest import router
+
+        data = router.serialize(ItemType.objects.all(), many=True)
+        self.assertEqual(data[0]["label"], "Test")
@@ -1,8 +1,19 @@
 from .base import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+import datetime
 import json
-from tests.naturalkey_app.models import ModelWithNaturalKey
+from wq.db import rest
+from wq.db.rest.serializers import resolve_natural_keys
+from tests.naturalkey_app.models import (
+    ModelWithNaturalKey,
+    NaturalKeyParent,
+    NaturalKeyChild,
+)
 
 
 class NaturalKeyTestCase(APITestCase):
@@ -71,3 +82,88 @@ class NaturalKeyTestCase(APITestCase):
                 "label": "test-key on 2016-12-31: Test Note",
             },
         )
+
+    def test_naturalkey_resolve_batch(self):
+        parent = NaturalKeyParent.objects.create(slug="existing")
+        existing = NaturalKeyChild.objects.create(
+            parent=parent, date=datetime.date(2016, 12, 31)
+        )
+        keys = [
+            ("existing", datetime.date(2016, 12, 31)),
+            ("existing", datetime.date(2017, 1, 1)),
+            ("new", datetime.date(2017, 1, 1)),
+            ("existing", datetime.date(2016, 12, 31)),
+        ]
+        cache = {}
+        saved = []
+
+        def on_save(sender, instance, created, **kwargs):
+            saved.append((sender, created))
+
+        post_save.connect(on_save)
+        self.addCleanup(post_save.disconnect, on_save)
+        objs = resolve_natural_keys(NaturalKeyChild, keys, cache)
+        self.assertEqual(objs[0], existing)
+        self.assertEqual(objs[3], existing)
+        self.assertEqual(objs[1].parent, parent)
+        self.assertEqual(objs[2].parent.slug, "new")
+        self.assertEqual(NaturalKeyChild.objects.count(), 3)
+        self.assertEqual(NaturalKeyParent.objects.count(), 2)
+
+        # New objects are saved normally
+        self.assertEqual(
+            saved,
+            [
+                (NaturalKeyChild, True),
+                (NaturalKeyParent, True),
+                (NaturalKeyChild, True),
+            ],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            resolve_natural_keys(NaturalKeyChild, keys, cache)
+        self.assertEqual(len(queries), 0)
+
+    def test_naturalkey_many(self):
+        serializer_class = rest.router.get_serializer_for_model(
+            ModelWithNaturalKey
+        )
+        rows = [
+            {
+                "key": {"parent": {"slug": "test-key"}, "date": date},
+                "note": "Note %s" % i,
+            }
+            for i, date in enumerate(["2016-12-31"] * 10 + ["2017-01-01"])
+        ]
+        serializer = serializer_class(
+            data=rows, many=True, context={"router": rest.router}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+
+        self.assertEqual(ModelWithNaturalKey.objects.count(), 11)
+        self.assertEqual(NaturalKeyChild.objects.count(), 2)
+        lookups = [
+            query
+            for query in queries
+            if 'FROM "naturalkey_app_naturalkeychild"' in query["sql"]
+        ]
+        self.assertEqual(len(lookups), 2)
+
+    def test_naturalkey_unresolved(self):
+        form = {
+            "key[parent][slug]": "test-key",
+            "key[date]": "2016-12-31",
+            "note": "Test Note",
+        }
+        with patch(
+            "wq.db.rest.serializers.resolve_natural_keys",
+            lambda model_class, keys, cache: [None for key in keys],
+        ):
+            response = self.client.post("/modelwithnaturalkeys.json", form)
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST, response.data
+        )
+        self.assertIn("key", response.data)
+        self.assertFalse(ModelWithNaturalKey.objects.exists())
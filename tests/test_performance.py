@@ -0,0 +1,270 @@
+from .base import APITestCase, APITransactionTestCase
+from rest_framework import serializers
+from django.db import models, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from wq.db.rest.serializers import (
+    ModelSerializer,
+    BlankCharField,
+    ClearableFileField,
+)
+from wq.db.rest.renderers import GeoJSONRenderer, JSONRenderer
+from wq.db.rest.views import ModelViewSet
+from wq.db.rest.timing import request_timed
+from unittest.mock import patch
+import json
+from tests.rest_app.models import (
+    Parent,
+    SlugModel,
+    SlugRefParent,
+    ItemType,
+    Item,
+    StreamModel,
+)
+
+
+class PerformanceTestCase(APITestCase):
+    def test_field_mapping_static(self):
+        mapping = ModelSerializer.serializer_field_mapping
+        ModelSerializer()
+        self.assertIs(mapping, ModelSerializer.serializer_field_mapping)
+        self.assertIs(mapping[models.CharField], BlankCharField)
+        self.assertIs(mapping[models.FileField], ClearableFileField)
+
+        # DRF's default mapping should be left untouched
+        self.assertIs(
+            serializers.ModelSerializer.serializer_field_mapping[
+                models.CharField
+            ],
+            serializers.CharField,
+        )
+
+    def test_field_mapping_not_rebuilt(self):
+        with patch("wq.db.rest.serializers.get_field_mapping") as mapping:
+            ModelSerializer()
+            ModelSerializer(data={})
+        mapping.assert_not_called()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count(self):
+        ref = SlugModel.objects.create(code="ref", name="Ref")
+        counts = {}
+        for total in (2, 10):
+            while Parent.objects.count() < total:
+                parent = Parent.objects.create(name="Parent")
+                parent.children.create(name="Child")
+                SlugRefParent.objects.create(ref=ref, name="Parent")
+            counts[total] = (
+                self.count_queries("/parents.json"),
+                self.count_queries("/slugrefparents.json"),
+            )
+        self.assertEqual(counts[2], counts[10])
+
+    def test_optimize_queryset_only(self):
+        from wq.db import rest
+
+        serializer_class = rest.router.get_serializer_for_model(Parent)
+        queryset = Parent.objects.all()
+        listed = rest.router.optimize_queryset(
+            queryset, serializer_class, only=True
+        )
+        self.assertTrue(listed.query.deferred_loading[0])
+        detail = rest.router.optimize_queryset(queryset, serializer_class)
+        self.assertFalse(detail.query.deferred_loading[0])
+
+        parent = Parent.objects.create(name="Parent")
+        with patch.object(
+            rest.router,
+            "optimize_queryset",
+            wraps=rest.router.optimize_queryset,
+        ) as optimize:
+            self.client.get("/parents.json")
+            self.assertTrue(optimize.call_args.kwargs["only"])
+            self.client.get("/parents/%s.json" % parent.pk)
+            self.assertFalse(optimize.call_args.kwargs["only"])
+
+    def test_optimize_queryset_cached_plan(self):
+        from wq.db import rest
+
+        Parent.objects.create(name="Parent")
+        rest.router.clear_serializer_cache()
+        self.addCleanup(rest.router.clear_serializer_cache)
+        with patch.object(
+            ModelSerializer,
+            "get_query_plan",
+            autospec=True,
+            side_effect=ModelSerializer.get_query_plan,
+        ) as get_plan:
+            first = self.client.get("/parents.json").data
+            calls = get_plan.call_count
+            self.assertGreater(calls, 0)
+            self.assertEqual(self.client.get("/parents.json").data, first)
+            self.assertEqual(get_plan.call_count, calls)
+
+            # Detail views are planned separately
+            self.client.get("/parents/%s.json" % first["list"][0]["id"])
+            self.assertGreater(get_plan.call_count, calls)
+
+        rest.router.clear_serializer_cache()
+        self.assertEqual(rest.router._query_plans, {})
+
+    def test_stream_geojson(self):
+        for i in range(5):
+            StreamModel.objects.create(name="Stream %s" % i)
+        response = self.client.get("/streammodels.geojson")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+        data = json.loads(
+            b"".join(self.client.get("/streammodels.json").streaming_content)
+        )
+        expected = GeoJSONRenderer().render(data)
+        self.assertEqual(b"".join(response.streaming_content), expected)
+
+        # GeoJSON is only streamed for models registered with stream=True
+        ItemType.objects.create(name="Type")
+        response = self.client.get("/itemtypes.geojson")
+        self.assertFalse(response.streaming)
+
+    def test_render_stream(self):
+        renderer = GeoJSONRenderer()
+        header = {"count": 2, "page": 1}
+        rows = [
+            {"id": 1, "latitude": 44, "longitude": -93},
+            {"id": 2, "latitude": None, "longitude": None},
+        ]
+        expected = renderer.render(
+            {**header, "list": [dict(row) for row in rows]}
+        )
+        streamed = b"".join(
+            renderer.render_stream(header, [dict(row) for row in rows])
+        )
+        self.assertEqual(streamed, expected)
+        streamed = b"".join(renderer.render_stream(header, []))
+        self.assertEqual(streamed, renderer.render({**header, "list": []}))
+
+    def test_stream_json(self):
+        for i in range(25):
+            ItemType.objects.create(name="Type %s" % i)
+        with patch.object(ModelViewSet, "stream_chunk_size", 7):
+            response = self.client.get("/itemtypes.json")
+        self.assertTrue(response.streaming)
+        self.assertFalse(hasattr(response, "data"))
+        self.assertNotIn("Content-Length", response)
+        content = b"".join(response.streaming_content)
+        data = json.loads(content)
+        self.assertEqual(len(data["list"]), 25)
+        self.assertEqual(
+            [item["label"] for item in data["list"]],
+            ["Type %s" % i for i in range(25)],
+        )
+        self.assertEqual(content, JSONRenderer().render(data))
+
+        # Paged and filtered requests are not streamed
+        response = self.client.get("/itemtypes.json?page=1")
+        self.assertFalse(response.streaming)
+
+    def test_render_stream_json(self):
+        renderer = JSONRenderer()
+        header = {"count": 2, "list": None, "extra": "\u2028"}
+        rows = [{"id": 1, "label": "One"}, {"id": 2, "label": "Two"}]
+        for indent in None, 4:
+            context = {"indent": indent}
+            self.assertEqual(
+                b"".join(
+                    renderer.render_stream(header, iter(rows), None, context)
+                ),
+                renderer.render({**header, "list": rows}, None, context),
+            )
+
+    def capture_timings(self):
+        timings = []
+
+        def receiver(sender, **kwargs):
+            timings.append(dict(kwargs, sender=sender))
+
+        request_timed.connect(receiver, weak=False)
+        self.addCleanup(request_timed.disconnect, receiver)
+        return timings
+
+    def test_timing_disabled(self):
+        timings = self.capture_timings()
+        response = self.client.get("/items.json")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(timings, [])
+
+    @override_settings(WQ_TIMING=True)
+    def test_timing(self):
+        itype = ItemType.objects.create(name="Type")
+        Item.objects.create(name="Item", type=itype)
+        timings = self.capture_timings()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/items.json?page=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(timings), 1)
+        timing = timings[0]
+        self.assertEqual(timing["sender"].model, Item)
+        self.assertEqual(timing["queries"], len(queries))
+        self.assertEqual(timing["queries"], 2)
+        self.assertGreater(timing["total"], 0)
+        for phase in "queryset", "filter", "paginate", "fields", "labels":
+            self.assertIn(phase, timing["phases"])
+        self.assertEqual(timing["phases"]["paginate"]["queries"], 1)
+
+        header = response["Server-Timing"].split(", ")
+        self.assertRegex(header[0], r'^total;dur=[\d.]+;desc="2 queries"$')
+        self.assertEqual(
+            [metric.split(";")[0] for metric in header[1:]],
+            list(timing["phases"]),
+        )
+        self.assertEqual(connection.execute_wrappers, [])
+
+    @override_settings(WQ_TIMING=True)
+    def test_timing_stream(self):
+        for i in range(3):
+            StreamModel.objects.create(name="Stream %s" % i)
+        timings = self.capture_timings()
+        response = self.client.get("/streammodels.geojson")
+        self.assertTrue(response.streaming)
+        self.assertIn("Server-Timing", response)
+        # Timing continues until the streamed content has been consumed
+        self.assertEqual(timings, [])
+        b"".join(response.streaming_content)
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(timings[0]["phases"]["geojson"]["calls"], 3)
+
+    @override_settings(WQ_TIMING=True)
+    def test_timing_multi(self):
+        timings = self.capture_timings()
+        response = self.client.get("/multi.json?lists=items,itemtypes")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(timings[0]["sender"].__name__, "MultipleListView")
+        self.assertEqual(timings[0]["phases"]["queryset"]["calls"], 2)
+
+
+class ThreadedTimingTestCase(APITransactionTestCase):
+    capture_timings = PerformanceTestCase.capture_timings
+
+    @override_settings(WQ_TIMING=True)
+    def test_timing_multi_threaded(self):
+        itype = ItemType.objects.create(name="Type")
+        Item.objects.create(name="Item", type=itype)
+        timings = self.capture_timings()
+        url = "/multi.json?lists=items,itemtypes"
+        self.client.get(url)
+        with override_settings(WQ_MULTI_MAX_WORKERS=2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(timings), 2)
+        single, threaded = timings
+
+        # Queries from the worker threads' connections are counted too
+        self.assertGreater(single["queries"], 0)
+        self.assertEqual(threaded["queries"], single["queries"])
+        self.assertEqual(threaded["phases"]["queryset"]["calls"], 2)
+        self.assertEqual(connection.execute_wrappers, [])
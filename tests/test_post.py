@@ -1,7 +1,12 @@
 from .base import APITestCase
 from rest_framework import status
-from .rest_app.models import SlugModel, FieldsetModel
-from django.contrib.auth.models import User
+from .rest_app.models import SlugModel, FieldsetModel, ItemType, Item
+from django.contrib.auth.models import User, Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models.signals import post_save
+from unittest.mock import patch
+from wq.db.rest.permissions import ModelPermissions
 
 
 class RestPostTestCase(APITestCase):
@@ -223,3 +228,173 @@ class RestPostTestCase(APITestCase):
         self.assertTrue(
             status.is_client_error(response.status_code), response.data
         )
+
+    def test_rest_bulk_post(self):
+        itype = ItemType.objects.create(name="Type")
+        item = Item.objects.create(name="Old", type=itype)
+        response = self.client.post(
+            "/items/bulk.json",
+            [
+                {"name": "New 1", "type_id": itype.pk},
+                {"id": item.pk, "name": "Updated", "type_id": itype.pk},
+                {"name": "Name too long", "type_id": itype.pk},
+                {"id": 9999, "name": "Missing", "type_id": itype.pk},
+                {"name": "New 2", "type_id": itype.pk},
+            ],
+            format="json",
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK, response.data
+        )
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual(response.data["errors"], 2)
+        results = response.data["list"]
+        self.assertEqual(
+            [result["status"] for result in results], [201, 200, 400, 404, 201]
+        )
+        self.assertIn("name", results[2]["errors"])
+        self.assertEqual(results[1]["id"], item.pk)
+        self.assertEqual(Item.objects.get(pk=results[0]["id"]).name, "New 1")
+        self.assertEqual(Item.objects.get(pk=results[4]["id"]).name, "New 2")
+        item.refresh_from_db()
+        self.assertEqual(item.name, "Updated")
+        self.assertEqual(Item.objects.count(), 3)
+
+        response = self.client.post(
+            "/items/bulk.json", {"name": "Not a list"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rest_bulk_post_invalid_ids(self):
+        itype = ItemType.objects.create(name="Type")
+        item = Item.objects.create(name="Old", type=itype)
+        response = self.client.post(
+            "/items/bulk.json",
+            [
+                {"id": "abc", "name": "Invalid", "type_id": itype.pk},
+                {"id": [1], "name": "Invalid", "type_id": itype.pk},
+                {"id": str(item.pk), "name": "Updated", "type_id": itype.pk},
+            ],
+            format="json",
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK, response.data
+        )
+        results = response.data["list"]
+        self.assertEqual(
+            [result["status"] for result in results], [404, 404, 200]
+        )
+        item.refresh_from_db()
+        self.assertEqual(item.name, "Updated")
+
+    def test_rest_bulk_post_custom_create(self):
+        from wq.db import rest
+
+        itype = ItemType.objects.create(name="Type")
+        serializer_class = rest.router.get_serializer_for_model(Item)
+        created = []
+
+        class CustomSerializer(serializer_class):
+            def create(self, validated_data):
+                created.append(validated_data["name"])
+                return super().create(validated_data)
+
+        serializer = CustomSerializer(
+            data=[
+                {"name": "New %s" % i, "type_id": itype.pk} for i in range(2)
+            ],
+            many=True,
+            context={"router": rest.router},
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(created, ["New 0", "New 1"])
+        self.assertEqual(Item.objects.count(), 2)
+
+    def test_rest_bulk_post_single_insert(self):
+        itype = ItemType.objects.create(name="Type")
+        saved = []
+
+        def on_save(sender, instance, created, **kwargs):
+            saved.append((instance.pk, created))
+
+        post_save.connect(on_save, sender=Item)
+        self.addCleanup(post_save.disconnect, on_save, sender=Item)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/items/bulk.json",
+                [
+                    {"name": "New %s" % i, "type_id": itype.pk}
+                    for i in range(5)
+                ],
+                format="json",
+            )
+        self.assertEqual(response.data["errors"], 0, response.data)
+        self.assertEqual(Item.objects.count(), 5)
+        inserts = [
+            query
+            for query in queries
+            if query["sql"].startswith('INSERT INTO "rest_app_item"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        # Signals are still sent for each record
+        self.assertEqual(
+            saved,
+            [(result["id"], True) for result in response.data["list"]],
+        )
+
+    def bulk_post_as(self, *perms):
+        user = User.objects.create(username="bulkuser")
+        user.user_permissions.set(
+            Permission.objects.filter(
+                content_type__app_label="rest_app",
+                codename__in=[perm + "_item" for perm in perms],
+            )
+        )
+        self.client.force_authenticate(user)
+        itype = ItemType.objects.create(name="Type")
+        item = Item.objects.create(name="Old", type=itype)
+        return item, self.client.post(
+            "/items/bulk.json",
+            [
+                {"name": "New", "type_id": itype.pk},
+                {"id": item.pk, "name": "Updated", "type_id": itype.pk},
+            ],
+            format="json",
+        )
+
+    def test_rest_bulk_post_change_only(self):
+        item, response = self.bulk_post_as("change")
+        self.assertEqual(
+            response.status_code, status.HTTP_200_OK, response.data
+        )
+        results = response.data["list"]
+        self.assertEqual([result["status"] for result in results], [403, 200])
+        item.refresh_from_db()
+        self.assertEqual(item.name, "Updated")
+        self.assertEqual(Item.objects.count(), 1)
+
+    def test_rest_bulk_post_add_only(self):
+        item, response = self.bulk_post_as("add")
+        results = response.data["list"]
+        self.assertEqual([result["status"] for result in results], [201, 403])
+        item.refresh_from_db()
+        self.assertEqual(item.name, "Old")
+
+    def test_rest_bulk_post_no_perms(self):
+        item, response = self.bulk_post_as()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rest_bulk_post_object_permissions(self):
+        def has_object_permission(self, request, view, obj):
+            return obj.name != "Old"
+
+        with patch.object(
+            ModelPermissions, "has_object_permission", has_object_permission
+        ):
+            item, response = self.bulk_post_as("add", "change")
+        results = response.data["list"]
+        self.assertEqual([result["status"] for result in results], [201, 403])
+        item.refresh_from_db()
+        self.assertEqual(item.name, "Old")
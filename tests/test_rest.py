@@ -1,4 +1,4 @@
-from .base import APITestCase
+from .base import APITestCase, APITransactionTestCase
 from rest_framework import status
 from tests.rest_app.models import (
     RootModel,
@@ -9,8 +9,33 @@ from tests.rest_app.models import (
     Parent,
     ItemType,
     SlugModel,
+    SlugRefParent,
+    SyncModel,
+    UUIDModel,
+    KeysetModel,
+    KeysetDateModel,
+    CachedCountModel,
+    HasNextModel,
+    EstimatedCountModel,
 )
+from wq.db.rest.pagination import (
+    invalidate_count,
+    Pagination,
+    HasNextPaginator,
+    EstimatedCountPaginator,
+)
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from urllib.parse import urlparse
+from base64 import urlsafe_b64encode
+import datetime
+import json
+from unittest.mock import patch
+import threading
 
 
 class RestTestCase(APITestCase):
@@ -78,6 +103,42 @@ class RestTestCase(APITestCase):
         self.assertIn("list", response.data)
         self.assertEqual(len(response.data["list"]), 2)
 
+    def test_rest_filter_by_missing_parent(self):
+        response = self.client.get("/parents/9999/children.json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/slugmodels/test/slugrefparents.json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get("/slugmodels/missing/slugrefparents.json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rest_filter_by_slug(self):
+        other = SlugModel.objects.create(code="other", name="Other")
+        SlugRefParent.objects.create(ref=SlugModel.objects.get(code="test"))
+        SlugRefParent.objects.create(ref=other)
+        SlugRefParent.objects.create(ref=other)
+
+        tests = [
+            (1, "/slugrefparents.json?ref=test"),
+            (2, "/slugrefparents.json?ref=other"),
+            (0, "/slugrefparents.json?ref=missing"),
+            (3, "/slugrefparents.json?ref__in=test,other"),
+            (1, "/slugrefparents.json?ref__in=test,missing"),
+            (2, "/children.json?name__in=Test 1,Other"),
+        ]
+        for expect_items, url in tests:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertTrue(
+                status.is_success(response.status_code), response.data
+            )
+            self.assertEqual(len(response.data["list"]), expect_items, url)
+            filters = [
+                query
+                for query in queries
+                if "slugmodel" in query["sql"].split("FROM")[1].split()[0]
+            ]
+            self.assertEqual(filters, [], url)
+
     def test_rest_detail_user_serializer(self):
         response = self.client.get("/usermanagedmodels/1.json")
         self.assertIn("user", response.data)
@@ -91,6 +152,47 @@ class RestTestCase(APITestCase):
             self.assertIn(listurl, response.data)
             self.assertIn("list", response.data[listurl])
             self.assertGreater(len(response.data[listurl]["list"]), 0)
+        self.assertEqual(list(response.data), lists)
+
+    def test_rest_multi_error(self):
+        from wq.db import rest
+
+        paginate = rest.router.paginate
+
+        def fail_items(model, page_num, request):
+            # The original request is never modified
+            assert request.GET["lists"] == "items,children"
+            if model._meta.model_name == "item":
+                raise ValueError("Failed")
+            return paginate(model, page_num, request)
+
+        self.client.raise_request_exception = False
+        lists = ["items", "children"]
+        with patch.object(rest.router, "paginate", fail_items):
+            response = self.client.get("/multi.json?lists=" + ",".join(lists))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["items"], {"detail": "Server Error (500)"}
+        )
+        self.assertGreater(len(response.data["children"]["list"]), 0)
+
+    def test_rest_multi_threaded(self):
+        from wq.db import rest
+
+        threads = set()
+
+        def paginate(model, page_num, request):
+            threads.add(threading.get_ident())
+            return {"list": [model._meta.model_name]}
+
+        lists = ["usermanagedmodels", "items", "children", "parents"]
+        with override_settings(WQ_MULTI_MAX_WORKERS=2), patch.object(
+            rest.router, "paginate", paginate
+        ):
+            response = self.client.get("/multi.json?lists=" + ",".join(lists))
+        self.assertEqual(list(response.data), lists)
+        self.assertEqual(response.data["children"], {"list": ["child"]})
+        self.assertNotIn(threading.get_ident(), threads)
 
     def test_rest_custom_lookup(self):
         response = self.client.get("/slugmodels/test.json")
@@ -117,23 +219,27 @@ class RestTestCase(APITestCase):
             ItemType.objects.create(pk=num, name="Type #%s" % num)
 
         tests = [
-            (100, "/itemtypes.json"),
-            (50, "/itemtypes/"),
-            (50, "/itemtypes.json?page=1"),
+            (100, "/itemtypes.json", True),
+            (50, "/itemtypes/", False),
+            (50, "/itemtypes.json?page=1", False),
         ]
-        for expect_items, url in tests:
+        for expect_items, url, streamed in tests:
             response = self.client.get(url)
-            self.assertTrue(
-                status.is_success(response.status_code), response.data
-            )
+            self.assertTrue(status.is_success(response.status_code))
+            # Unpaged JSON lists are streamed
+            self.assertEqual(response.streaming, streamed)
+            if streamed:
+                data = json.loads(b"".join(response.streaming_content))
+            else:
+                data = response.data
             self.assertEqual(
-                len(response.data["list"]),
+                len(data["list"]),
                 expect_items,
                 "%s should return %s items" % (url, expect_items),
             )
-            self.assertEqual(response.data["pages"], 2)
-            self.assertEqual(response.data["per_page"], 50)
-            self.assertEqual(response.data["count"], 100)
+            self.assertEqual(data["pages"], 2)
+            self.assertEqual(data["per_page"], 50)
+            self.assertEqual(data["count"], 100)
 
     def test_rest_cache_filter(self):
         other_user = User.objects.create(username="otheruser")
@@ -153,11 +259,13 @@ class RestTestCase(APITestCase):
             ]
             for expect_count, expect_items, url in tests:
                 response = self.client.get(url)
-                self.assertTrue(
-                    status.is_success(response.status_code), response.data
-                )
+                self.assertTrue(status.is_success(response.status_code))
+                if response.streaming:
+                    data = json.loads(b"".join(response.streaming_content))
+                else:
+                    data = response.data
                 self.assertEqual(
-                    len(response.data["list"]),
+                    len(data["list"]),
                     expect_items,
                     "%s should return %s items for %s"
                     % (
@@ -166,9 +274,9 @@ class RestTestCase(APITestCase):
                         "authed user" if auth else "anonymous user",
                     ),
                 )
-                self.assertEqual(response.data["pages"], 1)
-                self.assertEqual(response.data["per_page"], 50)
-                self.assertEqual(response.data["count"], expect_count)
+                self.assertEqual(data["pages"], 1)
+                self.assertEqual(data["per_page"], 50)
+                self.assertEqual(data["count"], expect_count)
 
     def test_rest_cache_none(self):
         tests = [
@@ -213,3 +321,424 @@ class RestTestCase(APITestCase):
         self.assertEqual(
             response.status_code, status.HTTP_200_OK, response.data
         )
+
+    def test_rest_field_cache(self):
+        from wq.db import rest
+
+        class CachedSerializer(
+            rest.router.get_serializer_for_model(Parent, 1)
+        ):
+            cache_fields = True
+
+            def build_fields(self, *args, **kwargs):
+                fields = super().build_fields(*args, **kwargs)
+                fields["name"].help_text = "Changed after construction"
+                return fields
+
+        context = {"router": rest.router}
+
+        rest.router.clear_serializer_cache()
+        fields = CachedSerializer(context=context).fields
+        cached_fields = CachedSerializer(context=context).fields
+        self.assertEqual(list(fields), list(cached_fields))
+        for name, field in fields.items():
+            cached_field = cached_fields[name]
+            self.assertIsNot(field, cached_field)
+            self.assertIs(type(field), type(cached_field))
+            self.assertEqual(field.read_only, cached_field.read_only)
+            self.assertEqual(field.source, cached_field.source)
+            self.assertEqual(field.help_text, cached_field.help_text)
+        self.assertEqual(
+            cached_fields["name"].help_text, "Changed after construction"
+        )
+
+        response = self.client.get("/parents/1.json")
+        self.assertEqual(len(response.data["children"]), 2)
+
+    def test_rest_field_cache_default(self):
+        from wq.db import rest
+
+        class UserSerializer(rest.router.get_serializer_for_model(Parent)):
+            def get_fields(self, *args, **kwargs):
+                fields = super().get_fields(*args, **kwargs)
+                if not self.context["user"].is_superuser:
+                    fields.pop("name")
+                return fields
+
+        admin = User(username="admin", is_superuser=True)
+        user = User(username="user")
+        context = {"router": rest.router}
+        self.assertIn(
+            "name", UserSerializer(context={**context, "user": admin}).fields
+        )
+        self.assertNotIn(
+            "name", UserSerializer(context={**context, "user": user}).fields
+        )
+        self.assertIn(
+            "name", UserSerializer(context={**context, "user": admin}).fields
+        )
+
+    def test_rest_field_cache_router_default(self):
+        from wq.db import rest
+
+        self.addCleanup(rest.router.clear_serializer_cache)
+        rest.router.clear_serializer_cache()
+        context = {"router": rest.router}
+
+        # Fields for the router's default serializer are cached
+        serializer_class = rest.router.get_serializer_for_model(ItemType)
+        self.assertTrue(rest.router.serializer_caches_fields(serializer_class))
+        self.assertIsNotNone(
+            serializer_class(context=context).get_field_cache_key()
+        )
+
+        # ... but not for custom serializers or subclasses of the default
+        self.assertFalse(
+            rest.router.serializer_caches_fields(
+                rest.router.get_serializer_for_model(Parent)
+            )
+        )
+
+        class UserSerializer(serializer_class):
+            pass
+
+        self.assertIsNone(
+            UserSerializer(context=context).get_field_cache_key()
+        )
+
+        with patch.object(
+            rest.router, "cache_default_serializer_fields", False
+        ):
+            rest.router.clear_serializer_cache()
+            serializer_class = rest.router.get_serializer_for_model(ItemType)
+            self.assertFalse(
+                rest.router.serializer_caches_fields(serializer_class)
+            )
+
+    def get_counted(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertTrue(status.is_success(response.status_code), response.data)
+        counts = [query for query in queries if "COUNT(" in query["sql"]]
+        return response.data, len(counts)
+
+    def test_rest_count_cached(self):
+        self.addCleanup(invalidate_count, CachedCountModel)
+        for i in range(3):
+            CachedCountModel.objects.create(name="Count %s" % i)
+
+        data, counts = self.get_counted("/cachedcountmodels.json")
+        self.assertEqual((data["count"], counts), (3, 1))
+        data, counts = self.get_counted("/cachedcountmodels.json")
+        self.assertEqual((data["count"], counts), (3, 0))
+        data, counts = self.get_counted("/cachedcountmodels.json?limit=2")
+        self.assertEqual((data["count"], data["pages"], counts), (3, 2, 0))
+
+        CachedCountModel.objects.create(name="Count 3")
+        data, counts = self.get_counted("/cachedcountmodels.json")
+        self.assertEqual((data["count"], counts), (4, 1))
+
+        CachedCountModel.objects.first().delete()
+        data, counts = self.get_counted("/cachedcountmodels.json")
+        self.assertEqual((data["count"], counts), (3, 1))
+
+    def test_rest_count_has_next(self):
+        for i in range(3):
+            HasNextModel.objects.create(name="Next %s" % i)
+
+        data, counts = self.get_counted("/hasnextmodels.json?limit=2")
+        self.assertEqual(counts, 0)
+        self.assertEqual(len(data["list"]), 2)
+        self.assertIsNone(data["count"])
+        self.assertIsNone(data["pages"])
+        self.assertTrue(data["multiple"])
+        self.assertIn("page=2", data["next"])
+
+        data, counts = self.get_counted("/hasnextmodels.json?limit=2&page=2")
+        self.assertEqual(counts, 0)
+        self.assertEqual(len(data["list"]), 1)
+        self.assertIsNone(data["next"])
+        self.assertTrue(data["multiple"])
+
+        data, counts = self.get_counted("/hasnextmodels.json")
+        self.assertEqual(len(data["list"]), 3)
+        self.assertFalse(data["multiple"])
+
+        response = self.client.get("/hasnextmodels.json?limit=2&page=3")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # The last page is only counted when explicitly requested
+        data, counts = self.get_counted(
+            "/hasnextmodels.json?limit=2&page=last"
+        )
+        self.assertEqual(counts, 1)
+        self.assertEqual(data["page"], 2)
+        self.assertEqual(len(data["list"]), 1)
+
+    def test_rest_count_has_next_html_controls(self):
+        for i in range(5):
+            HasNextModel.objects.create(name="Next %s" % i)
+
+        class HasNextPagination(Pagination):
+            def get_paginator_class(self, model, view=None):
+                return HasNextPaginator
+
+        pagination = HasNextPagination()
+        request = Request(
+            APIRequestFactory().get("/hasnextmodels/?limit=2&page=2")
+        )
+        pagination.paginate_queryset(
+            HasNextModel.objects.order_by("pk"), request
+        )
+        context = pagination.get_html_context()
+        self.assertEqual(
+            [link.number for link in context["page_links"]], [1, 2, 3]
+        )
+        self.assertIn("page=3", context["next_url"])
+
+    def test_rest_count_exact_paginator_class(self):
+        from django.core.paginator import Paginator
+
+        class CustomPaginator(Paginator):
+            pass
+
+        class CustomPagination(Pagination):
+            django_paginator_class = CustomPaginator
+
+        self.assertIs(
+            CustomPagination().get_paginator_class(HasNextModel),
+            CustomPaginator,
+        )
+        self.assertIs(
+            Pagination().get_paginator_class(HasNextModel), Paginator
+        )
+
+    def test_rest_count_estimate(self):
+        # Estimates are only used on PostgreSQL (and for large tables)
+        EstimatedCountModel.objects.create(name="Test")
+        data, counts = self.get_counted("/estimatedcountmodels.json")
+        self.assertEqual(data["count"], 1)
+
+    def test_rest_count_estimate_low(self):
+        for i in range(5):
+            EstimatedCountModel.objects.create(name="Count %s" % i)
+
+        # Pages past a (low) estimate are still served
+        with patch.object(
+            EstimatedCountPaginator, "min_estimate", 0
+        ), patch.object(
+            EstimatedCountPaginator, "get_estimate", return_value=2
+        ):
+            data, counts = self.get_counted(
+                "/estimatedcountmodels.json?limit=2&page=2"
+            )
+            self.assertEqual((data["count"], counts), (2, 0))
+            self.assertEqual(len(data["list"]), 2)
+            self.assertIn("page=3", data["next"])
+
+            data, counts = self.get_counted(
+                "/estimatedcountmodels.json?limit=2&page=3"
+            )
+            self.assertEqual(len(data["list"]), 1)
+            self.assertIsNone(data["next"])
+
+            response = self.client.get(
+                "/estimatedcountmodels.json?limit=2&page=4"
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_404_NOT_FOUND
+            )
+
+    def test_rest_keyset_pagination(self):
+        for name in "ABBBCDEF":
+            KeysetModel.objects.create(code=name.lower(), name=name)
+        expected = list(
+            KeysetModel.objects.order_by("-name", "pk").values_list(
+                "code", flat=True
+            )
+        )
+
+        codes = []
+        url = "/keysetmodels.json?limit=3"
+        page = 0
+        while url:
+            page += 1
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertTrue(
+                status.is_success(response.status_code), response.data
+            )
+            for query in queries:
+                self.assertNotIn("OFFSET", query["sql"])
+            self.assertEqual(response.data["page"], page)
+            self.assertEqual(response.data["per_page"], 3)
+            self.assertTrue(response.data["multiple"])
+            self.assertNotIn("count", response.data)
+            codes += [obj["id"] for obj in response.data["list"]]
+            url = response.data["next"]
+            if url:
+                url = "/keysetmodels.json?" + urlparse(url).query
+
+        self.assertEqual(codes, expected)
+        self.assertEqual(page, 3)
+
+        response = self.client.get("/keysetmodels.json")
+        self.assertEqual(len(response.data["list"]), 8)
+        self.assertIsNone(response.data["next"])
+        self.assertFalse(response.data["multiple"])
+
+    def test_rest_keyset_pagination_datetime(self):
+        # Rows within the same millisecond
+        date = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        for i in range(7):
+            KeysetDateModel.objects.create(
+                name="Row %s" % i,
+                date=date + datetime.timedelta(microseconds=i * 10),
+            )
+
+        names = []
+        url = "/keysetdatemodels.json?limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertTrue(
+                status.is_success(response.status_code), response.data
+            )
+            names += [obj["name"] for obj in response.data["list"]]
+            url = response.data["next"]
+            if url:
+                url = "/keysetdatemodels.json?" + urlparse(url).query
+
+        self.assertEqual(names, ["Row %s" % i for i in reversed(range(7))])
+
+    def test_rest_keyset_invalid_cursor(self):
+        KeysetModel.objects.create(code="a", name="A")
+
+        def encode(data):
+            return urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        for cursor in (
+            "invalid",
+            encode("invalid"),
+            encode([2, "x"]),
+            encode([2, ["x"]]),
+            encode([2, ["x", "abc"]]),
+            encode([2, ["x", "abc", 1]]),
+            encode(["x", ["x", 1]]),
+        ):
+            response = self.client.get("/keysetmodels.json?cursor=" + cursor)
+            self.assertEqual(
+                response.status_code, status.HTTP_404_NOT_FOUND, cursor
+            )
+            self.assertEqual(response.data["detail"], "Invalid cursor")
+
+        response = self.client.get(
+            "/keysetmodels.json?cursor=" + encode([2, ["B", 0]])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["list"]), 1)
+
+    def test_rest_changes_since(self):
+        self.client.force_authenticate(self.user)
+        other_user = User.objects.create(username="otheruser")
+        SyncModel.objects.create(id=1, user=self.user)
+        second = SyncModel.objects.create(id=2, user=self.user)
+        third = SyncModel.objects.create(id=3, user=self.user)
+
+        response = self.client.get("/syncmodels.json")
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(data["list"]), 3)
+        sync_token = data["sync_token"]
+
+        response = self.client.get(
+            "/syncmodels.json?since=%s" % sync_token
+        )
+        self.assertEqual(response.data["list"], [])
+        self.assertEqual(response.data["deleted"], [])
+
+        SyncModel.objects.create(id=4, user=self.user)
+        SyncModel.objects.create(id=5, user=other_user)
+        second.save()
+        third.delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/syncmodels.json?since=%s" % sync_token
+            )
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertLess(len(queries), 6)
+        self.assertEqual(
+            sorted(obj["id"] for obj in response.data["list"]), [2, 4]
+        )
+        self.assertEqual(response.data["deleted"], [3, 5])
+        self.assertGreater(response.data["sync_token"], sync_token)
+
+        response = self.client.get(
+            "/syncmodels.json?since=%s" % response.data["sync_token"]
+        )
+        self.assertEqual(response.data["list"], [])
+
+        response = self.client.get("/syncmodels.json?since=abc")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rest_changes_since_uuid(self):
+        first = UUIDModel.objects.create(name="First")
+        second = UUIDModel.objects.create(name="Second")
+        response = self.client.get("/uuidmodels.json")
+        sync_token = json.loads(b"".join(response.streaming_content))[
+            "sync_token"
+        ]
+
+        first.name = "First Updated"
+        first.save()
+        second_id = str(second.pk)
+        second.delete()
+        third = UUIDModel.objects.create(name="Third")
+
+        response = self.client.get("/uuidmodels.json?since=%s" % sync_token)
+        self.assertEqual(
+            sorted(obj["id"] for obj in response.data["list"]),
+            sorted([str(first.pk), str(third.pk)]),
+        )
+        self.assertEqual(
+            [str(pk) for pk in response.data["deleted"]], [second_id]
+        )
+
+
+class RestThreadedTestCase(APITransactionTestCase):
+    def test_rest_multi_threaded_paginate(self):
+        from wq.db import rest
+
+        parent = Parent.objects.create(name="Test")
+        parent.children.create(name="Test 1")
+        parent.children.create(name="Test 2")
+        itype = ItemType.objects.create(name="Test")
+        itype.item_set.create(name="Test 1")
+
+        paginate = rest.router.paginate
+        worker_connections = {}
+
+        def tracked_paginate(model, page_num, request):
+            data = paginate(model, page_num, request)
+            worker_connections[threading.get_ident()] = connections["default"]
+            return data
+
+        lists = ["items", "children", "parents", "itemtypes"]
+        with override_settings(WQ_MULTI_MAX_WORKERS=2), patch.object(
+            rest.router, "paginate", tracked_paginate
+        ):
+            response = self.client.get("/multi.json?lists=" + ",".join(lists))
+
+        self.assertEqual(list(response.data), lists)
+        self.assertEqual(
+            [obj["label"] for obj in response.data["children"]["list"]],
+            ["Test 1", "Test 2"],
+        )
+        self.assertEqual(len(response.data["items"]["list"]), 1)
+        self.assertEqual(len(response.data["parents"]["list"]), 1)
+
+        # Queries ran in worker threads, on their own connections, which are
+        # closed once each list is done
+        self.assertNotIn(threading.get_ident(), worker_connections)
+        for conn in worker_connections.values():
+            self.assertIsNot(conn, connection)
+            self.assertIsNone(conn.connection)
@@ -1,5 +1,6 @@
 from .base import APITestCase
 from django.core.exceptions import ImproperlyConfigured
+from unittest.mock import patch
 
 
 class RestRouterTestCase(APITestCase):
@@ -62,3 +63,114 @@ class RestRouterTestCase(APITestCase):
             )
 
         self.assertNotIn(TestModel, rest.router._models)
+
+    def test_rest_serializer_cache(self):
+        from wq.db import rest
+        from tests.rest_app.models import Child
+
+        serializer = rest.router.get_serializer_for_model(Child)
+        info = rest.router.serializer_cache_info()
+        self.assertIs(serializer, rest.router.get_serializer_for_model(Child))
+        self.assertEqual(
+            rest.router.serializer_cache_info().hits, info.hits + 1
+        )
+
+        # Depth is part of the cache key
+        detail_serializer = rest.router.get_serializer_for_model(Child, 1)
+        self.assertIsNot(serializer, detail_serializer)
+        self.assertEqual(detail_serializer.Meta.depth, 1)
+
+        # Config changes invalidate the cache
+        rest.router.update_config(Child, per_page=100)
+        self.assertEqual(rest.router.serializer_cache_info().currsize, 0)
+        serializer2 = rest.router.get_serializer_for_model(Child)
+        self.assertIsNot(serializer, serializer2)
+        self.assertEqual(serializer2.Meta.wq_config["per_page"], 100)
+        self.assertEqual(
+            rest.router.serializer_cache_info().misses,
+            info.misses + 2,
+        )
+
+    def test_rest_viewset_cache(self):
+        from wq.db import rest
+        from tests.rest_app.models import Child
+
+        viewset = rest.router.get_viewset_for_model(Child)
+        self.assertIs(viewset, rest.router.get_viewset_for_model(Child))
+        self.assertIs(viewset, rest.router.get_viewset_for_model("child"))
+        self.assertEqual(viewset.pagination_class.page_size, 100)
+
+        # Config changes rebuild the viewset class
+        rest.router.update_config(Child, per_page=100)
+        self.assertIsNot(viewset, rest.router.get_viewset_for_model(Child))
+
+    def test_rest_incremental_config(self):
+        from wq.db import rest
+        from wq.db.rest import routers
+        from wq.db.rest.serializers import ModelSerializer
+        from tests.rest_app.models import CharFieldModel, Parent
+
+        config = rest.router.config
+        get_wq_config = ModelSerializer.get_wq_config
+        calls = []
+
+        def track_config(serializer):
+            calls.append(serializer.Meta.model)
+            return get_wq_config(serializer)
+
+        with patch.object(
+            ModelSerializer, "get_wq_config", track_config
+        ), patch.object(
+            routers, "update_map_config", wraps=routers.update_map_config
+        ) as update_map_config:
+            # Extra config does not require rebuilding pages or map layers
+            rest.router.set_extra_config()
+            self.assertIsNot(config, rest.router.config)
+            self.assertEqual(config, rest.router.config)
+            self.assertEqual(calls, [])
+            self.assertEqual(update_map_config.call_count, 0)
+
+            # Only the updated page is rebuilt
+            rest.router.update_config(CharFieldModel)
+            self.assertEqual(config, rest.router.config)
+            self.assertEqual(calls, [CharFieldModel])
+
+            # ... along with any pages referencing it
+            calls.clear()
+            rest.router.update_config(Parent)
+            self.assertEqual(config, rest.router.config)
+            self.assertIn(Parent, calls)
+            self.assertNotIn(CharFieldModel, calls)
+            self.assertEqual(
+                rest.router.config["pages"]["child"]["form"][-1][
+                    "wq:ForeignKey"
+                ],
+                "parent",
+            )
+
+    def test_rest_foreignkey_config(self):
+        from wq.db import rest
+        from wq.db.rest.serializers import ModelSerializer
+        from tests.rest_app.models import Child
+
+        build_wq_config = ModelSerializer.build_wq_config
+        rest.router.config
+        calls = []
+
+        def track_config(serializer):
+            calls.append(type(serializer))
+            return build_wq_config(serializer)
+
+        with patch.object(ModelSerializer, "build_wq_config", track_config):
+            # Foreign key names come from the router, not the related config
+            serializer = rest.router.get_serializer_for_model(Child)
+            conf = serializer(context={"router": rest.router}).get_wq_config()
+            self.assertEqual(conf["form"][-1]["wq:ForeignKey"], "parent")
+            self.assertEqual(calls, [serializer])
+
+            # Each serializer class is only configured once per build
+            calls.clear()
+            rest.router.invalidate_page_config()
+            rest.router.config
+            self.assertTrue(calls)
+            self.assertEqual(len(calls), len(set(calls)))
@@ -1,4 +1,4 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 
 class RestConfig(AppConfig):
@@ -6,3 +6,7 @@ class RestConfig(AppConfig):
 
     def ready(self):
         self.module.autodiscover()
+        if apps.is_installed("django.contrib.auth"):
+            from .permissions import connect_perm_signals
+
+            connect_perm_signals()
@@ -11,13 +11,17 @@ class AuthView(SimpleViewSet):
     def user_info(self, request):
         user_dict = rest.router.serialize(request.user)
         user_dict["id"] = rest.router.get_object_id(request.user)
-        return Response(
-            {
-                "user": user_dict,
-                "config": rest.router.get_user_config(request.user),
-                "csrftoken": csrf.get_token(request),
-            }
-        )
+        config, config_hash = rest.router.get_user_config_info(request.user)
+        result = {
+            "user": user_dict,
+            "config": config,
+            "config_hash": config_hash,
+            "csrftoken": csrf.get_token(request),
+        }
+        # Clients that already have this config can skip the payload
+        if request.GET.get("config_hash") == config_hash:
+            del result["config"]
+        return Response(result)
 
     def csrf_info(self, request):
         response = {}
@@ -14,31 +14,38 @@ class FilterBackend(BaseFilterBackend):
                 kwargs[key] = val
         model = getattr(view, "model", None) or queryset.model
 
+        router = getattr(view, "router", None)
         for key, val in list(kwargs.items()):
-            field_name = key.split("__")[0]
+            field_name, *lookups = key.split("__")
             try:
                 field = model._meta.get_field(field_name)
             except FieldDoesNotExist:
                 del kwargs[key]
                 continue
 
-            if field_name != key:
+            if lookups == ["in"]:
+                if isinstance(val, str):
+                    val = val.split(",")
+                kwargs[key] = val
+            elif lookups:
                 continue
 
             if val == "null":
                 del kwargs[key]
-                kwargs[f"{key}__isnull"] = True
+                kwargs[f"{field_name}__isnull"] = True
+                continue
 
             rel = field.remote_field
             if not rel:
                 continue
 
-            pcls = rel.model
-            router = getattr(view, "router", None)
+            # Filter on the related model's lookup field in the main query
+            # (rather than retrieving the related object first)
             if router:
-                slug = router.get_lookup_for_model(pcls)
-                kwargs[key] = pcls.objects.get(**{slug: val})
+                slug = router.get_lookup_for_model(rel.model)
             else:
-                kwargs[key] = pcls.objects.get(pk=val)
+                slug = "pk"
+            del kwargs[key]
+            kwargs["__".join([field.name, slug] + lookups)] = val
 
         return queryset.filter(**kwargs)
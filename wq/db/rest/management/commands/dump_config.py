@@ -1,7 +1,5 @@
 from django.core.management.base import BaseCommand
 from wq.db import rest
-from rest_framework.utils import encoders
-import json
 
 
 class Command(BaseCommand):
@@ -24,13 +22,4 @@ class Command(BaseCommand):
 
 
 def dump_config(f, format="json", **kwargs):
-    text = json.dumps(
-        rest.router.config,
-        cls=encoders.JSONEncoder,
-        indent=4,
-    )
-    if format == "esm":
-        text = "const config = %s;\nexport default config;" % text
-    elif format == "amd":
-        text = "define(%s);" % text
-    f.write(text)
+    f.write(rest.router.get_config_text(format))
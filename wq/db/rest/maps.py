@@ -2,6 +2,22 @@ from django.db.models import Func, Value
 from django.http import HttpResponse
 from django.db import connection
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from urllib.parse import urlencode
+import hashlib
+import math
+import uuid
+
+
+TILE_KEY = "wq-tile:%s"
+TILE_VERSION_KEY = "wq-tile-version:%s:%s"
+TILE_EXTENT_KEY = "wq-tile-extent:%s"
+
+# Tiles at or beyond this zoom level are invalidated by region; tiles below it
+# (which each cover several regions) are invalidated on any change.
+TILE_REGION_ZOOM = 8
+TILE_REGION_LIMIT = 64
 
 
 def supports_vector_tiles():
@@ -13,6 +29,44 @@ def supports_vector_tiles():
         return False
 
 
+def supports_db_geojson():
+    backend = settings.DATABASES.get("default", {}).get("ENGINE")
+
+    if backend in (
+        "django.contrib.gis.db.backends.postgis",
+        "django.contrib.gis.db.backends.spatialite",
+    ):
+        return True
+    else:
+        return False
+
+
+def get_geojson_annotation(name):
+    return f"{name}_geojson"
+
+
+def annotate_geojson(queryset, names):
+    """
+    Generate GeoJSON in the database (rather than via GEOS) and defer the
+    raw geometry columns.  See GeometryField.get_attribute().
+    """
+    from django.contrib.gis.db.models.functions import AsGeoJSON
+
+    names = [name for name in names if "." not in name]
+    if not names:
+        return queryset
+    return queryset.defer(*names).annotate(
+        **{get_geojson_annotation(name): AsGeoJSON(name) for name in names}
+    )
+
+
+def get_tile_cache_timeout():
+    """
+    Tile caching (and the tile versions it relies on) is opt-in
+    """
+    return getattr(settings, "WQ_TILE_CACHE_TIMEOUT", None) or 0
+
+
 def tiles(router, request, z, x, y):
     if not supports_vector_tiles():
         return HttpResponse(
@@ -20,9 +74,7 @@ def tiles(router, request, z, x, y):
             content_type="text/plain",
             status=404,
         )
-    tiledata = []
-    envelope = TileEnvelope(z, x, y)
-    cursor = connection.cursor()
+    layers = []
     for name, conf in router.config["pages"].items():
         if not conf.get("list") or not conf.get("geometry_fields"):
             continue
@@ -31,35 +83,309 @@ def tiles(router, request, z, x, y):
         if lookup := conf.get("lookup"):
             fields.append(lookup)
         fields += list(conf.get("vector_tile_fields") or [])
+        layers.append((name, conf, fields))
+
+    timeout = get_tile_cache_timeout()
+    if not timeout:
+        return HttpResponse(
+            get_tile_content(router, request, layers, z, x, y),
+            content_type="application/vnd.mapbox-vector-tile",
+        )
 
-        queryset = router.get_queryset_for_model(name, request)
+    visibility = get_tile_visibility(router, request, layers)
+    versions = get_tile_versions(
+        [router._page_models[name]._meta.label_lower for name, *_ in layers],
+        get_tile_region(z, x, y),
+    )
+    signature = (
+        (z, x, y),
+        visibility,
+        versions,
+        [
+            (name, fields, conf["geometry_fields"])
+            for name, conf, fields in layers
+        ],
+    )
+    digest = hashlib.md5(repr(signature).encode()).hexdigest()
+    key = TILE_KEY % digest
+    etag = '"%s"' % digest
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content = cache.get(key)
+        if content is None:
+            content = get_tile_content(router, request, layers, z, x, y)
+            cache.set(key, content, timeout)
+        response = HttpResponse(
+            content,
+            content_type="application/vnd.mapbox-vector-tile",
+        )
+    response["ETag"] = etag
+    response["Cache-Control"] = "%s, max-age=%s" % (
+        "private" if visibility.startswith("user") else "public",
+        getattr(settings, "WQ_TILE_MAX_AGE", 0),
+    )
+    return response
+
+
+def get_tile_content(router, request, layers, z, x, y):
+    """
+    Render every layer in a single statement (ST_AsMVT(...) || ...),
+    skipping layers whose extent does not reach the tile.
+    """
+    envelope = TileEnvelope(z, x, y)
+    bounds = get_tile_bounds(z, x, y)
+    queries = []
+    params = []
+    for name, conf, fields in layers:
+        extents = get_layer_extents(router._page_models[name])
+        queryset = None
         for field in conf["geometry_fields"]:
+            if field["name"] in extents and not extent_overlaps(
+                extents[field["name"]], bounds
+            ):
+                continue
+            if queryset is None:
+                queryset = router.get_queryset_for_model(name, request)
             model_info = (name, queryset, field["name"], fields)
-            tiledata.append(get_tile_data(model_info, envelope, cursor))
+            sql, layer_params = get_tile_sql(model_info, envelope)
+            queries.append(f"COALESCE(({sql}), ''::bytea)")
+            params += layer_params
+
+    if not queries:
+        return b""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT " + " || ".join(queries), params)
+        return bytes(cursor.fetchone()[0])
+
+
+def get_layer_extents(model):
+    """
+    Lon/lat extent of each geometry column (None if there are no rows).
+    Computed once and then only widened by expand_layer_extents(), so it
+    may be larger than needed after deletes.  Extents are kept up to date
+    whether or not WQ_TILE_CACHE_TIMEOUT is set.
+    """
+    from django.contrib.gis.db.models import Extent
+    from django.contrib.gis.db.models.functions import Transform
+
+    key = TILE_EXTENT_KEY % model._meta.label_lower
+    extents = cache.get(key)
+    if extents is None:
+        names = [field.name for field in get_model_geometry_fields(model)]
+        result = model._base_manager.aggregate(
+            **{
+                f"{name}_extent": Extent(Transform(name, 4326))
+                for name in names
+            }
+        )
+        extents = {name: result[f"{name}_extent"] for name in names}
+        cache.set(key, extents, None)
+    return extents
+
+
+def get_tile_bounds(z, x, y):
+    """
+    Lon/lat bounds of a tile, padded to include the MVT buffer (256/4096)
+    """
+    n = 2**z
 
-    return HttpResponse(
-        b"".join(tiledata),
-        content_type="application/vnd.mapbox-vector-tile",
+    def lon(x):
+        return x / n * 360 - 180
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    pad = 1 / 16
+    return (
+        lon(x - pad),
+        lat(min(y + 1 + pad, n)),
+        lon(x + 1 + pad),
+        lat(max(y - pad, 0)),
     )
 
 
+def expand_layer_extents(model, extents):
+    """
+    Drop the cached layer extents if a saved geometry falls outside them
+    """
+    key = TILE_EXTENT_KEY % model._meta.label_lower
+    layer_extents = cache.get(key)
+    if layer_extents is None:
+        return
+    for name, extent in extents.items():
+        current = layer_extents.get(name)
+        if not current or not extent_contains(current, extent):
+            cache.delete(key)
+            return
+
+
+def extent_contains(extent, other):
+    xmin, ymin, xmax, ymax = extent
+    oxmin, oymin, oxmax, oymax = other
+    return xmin <= oxmin and ymin <= oymin and xmax >= oxmax and ymax >= oymax
+
+
+def extent_overlaps(extent, bounds):
+    if not extent:
+        return False
+    xmin, ymin, xmax, ymax = extent
+    west, south, east, north = bounds
+    return xmin <= east and xmax >= west and ymin <= north and ymax >= south
+
+
+def get_tile_visibility(router, request, layers):
+    """
+    Tiles are shared unless a custom filter (which might depend on the
+    user or the query string) applies to one of the layers.
+    """
+    for name, *_ in layers:
+        if router._page_models[name] in router._filters:
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                visibility = "user-%s" % user.pk
+            else:
+                visibility = "anonymous"
+            if request.GET:
+                visibility += "?" + urlencode(
+                    sorted(
+                        (key, sorted(values))
+                        for key, values in request.GET.lists()
+                    ),
+                    doseq=True,
+                )
+            return visibility
+    return "public"
+
+
+def get_tile_region(z, x, y):
+    if z < TILE_REGION_ZOOM:
+        return "overview"
+    shift = z - TILE_REGION_ZOOM
+    return "%s/%s" % (x >> shift, y >> shift)
+
+
+def get_tile_regions(extent):
+    """
+    List the regions (tiles at TILE_REGION_ZOOM) overlapping a lon/lat
+    extent, padded by one region to account for tile buffers.  Returns None
+    if there would be more than TILE_REGION_LIMIT.
+    """
+    xmin, ymin, xmax, ymax = extent
+    x0, y0 = get_tile_coords(xmin, ymax, TILE_REGION_ZOOM)
+    x1, y1 = get_tile_coords(xmax, ymin, TILE_REGION_ZOOM)
+    last = 2**TILE_REGION_ZOOM - 1
+    xs = range(max(x0 - 1, 0), min(x1 + 1, last) + 1)
+    ys = range(max(y0 - 1, 0), min(y1 + 1, last) + 1)
+    if len(xs) * len(ys) > TILE_REGION_LIMIT:
+        return None
+    return ["%s/%s" % (x, y) for x in xs for y in ys]
+
+
+def get_tile_coords(lon, lat, z):
+    n = 2**z
+    lat = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def get_tile_versions(labels, region):
+    keys = [
+        TILE_VERSION_KEY % (label, part)
+        for label in labels
+        for part in ("all", region)
+    ]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tiles(model, extents):
+    """
+    Invalidate cached tiles overlapping any of the given lon/lat extents
+    (or every tile for the model, if extents is None)
+    """
+    label = model._meta.label_lower
+    if extents is None:
+        cache.delete(TILE_VERSION_KEY % (label, "all"))
+        return
+    regions = set()
+    for extent in extents:
+        extent_regions = get_tile_regions(extent)
+        if extent_regions is None:
+            cache.delete(TILE_VERSION_KEY % (label, "all"))
+            return
+        regions.update(extent_regions)
+    if len(regions) > TILE_REGION_LIMIT:
+        cache.delete(TILE_VERSION_KEY % (label, "all"))
+    elif regions:
+        cache.delete_many(
+            [
+                TILE_VERSION_KEY % (label, region)
+                for region in ["overview"] + sorted(regions)
+            ]
+        )
+
+
+def get_model_geometry_fields(model):
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if hasattr(field, "geom_type")
+    ]
+
+
+def get_geometry_extents(instance):
+    extents = {}
+    for field in get_model_geometry_fields(type(instance)):
+        geom = getattr(instance, field.attname)
+        if not geom:
+            continue
+        if geom.srid and geom.srid != 4326:
+            geom = geom.transform(4326, clone=True)
+        extents[field.name] = geom.extent
+    return extents
+
+
+def invalidate_instance_tiles(sender, instance, created=True, **kwargs):
+    """
+    post_save/post_delete handler.  The previous location of an updated
+    instance is not known (and is not queried for), so updates invalidate
+    every cached tile for the model.
+    """
+    extents = get_geometry_extents(instance)
+    expand_layer_extents(sender, extents)
+    if not get_tile_cache_timeout():
+        return
+    invalidate_tiles(sender, list(extents.values()) if created else None)
+
+
 def get_tile_data(model_info, envelope, cursor):
+    sql, params = get_tile_sql(model_info, envelope)
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    return row[0]
+
+
+def get_tile_sql(model_info, envelope):
     name, queryset, geometry_field, fields = model_info
     geometry_mvt = f"{geometry_field}_mvt"
     fields = fields + [geometry_mvt]
     tile = (
-        queryset.filter(geometry__bboverlaps=envelope)
+        queryset.filter(**{f"{geometry_field}__bboverlaps": envelope})
         .annotate(**{geometry_mvt: TileGeom(geometry_field, envelope)})
         .values(*fields)
     )
     sql, params = tile.query.sql_with_params()
     sql = sql.replace(f'::bytea AS "{geometry_mvt}"', f' AS "{geometry_mvt}"')
-    cursor.execute(
+    return (
         f"SELECT ST_AsMVT(tile.*, '{name}', 4096, '{geometry_mvt}', 'id') FROM ({sql}) AS tile",
         params,
     )
-    row = cursor.fetchone()
-    return row[0]
 
 
 class TileEnvelope(Func):
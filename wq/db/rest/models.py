@@ -1,12 +1,115 @@
 from django.db import models
+from django.core.exceptions import FieldDoesNotExist
 import pystache
 
 
+LABEL_TEMPLATES = {}
+LABEL_RENDERER = pystache.Renderer()
+
+
 class LabelModel(models.Model):
     wq_label_template = "{{name}}"
 
     def __str__(self):
-        return pystache.render(self.wq_label_template, self)
+        return LABEL_RENDERER.render(
+            get_label_template(self.wq_label_template), self
+        )
+
+    @classmethod
+    def get_label_related(cls):
+        return get_label_related(cls)
 
     class Meta:
         abstract = True
+
+
+def get_label_template(template):
+    if template not in LABEL_TEMPLATES:
+        LABEL_TEMPLATES[template] = pystache.parse(template)
+    return LABEL_TEMPLATES[template]
+
+
+def get_template_keys(parsed):
+    keys = []
+    for node in parsed._parse_tree:
+        if isinstance(node, str) or type(node).__name__ == "_PartialNode":
+            continue
+        key = getattr(node, "key", None)
+        if key and key != "." and key not in keys:
+            keys.append(key)
+        section = getattr(node, "parsed", None) or getattr(
+            node, "parsed_section", None
+        )
+        if section:
+            for key in get_template_keys(section):
+                if key not in keys:
+                    keys.append(key)
+    return keys
+
+
+def get_label_related(model, prefix="", depth=3):
+    """
+    List the select_related() paths needed to render labels for model
+    """
+    template = getattr(model, "wq_label_template", None)
+    if not template or depth == 0 or not is_label_model(model):
+        return []
+
+    related = []
+    for key in get_template_keys(get_label_template(template)):
+        current = model
+        path = prefix
+        names = key.split(".")
+        for i, name in enumerate(names):
+            try:
+                field = current._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+            if field.name != name or not field.concrete:
+                break
+            if not (field.many_to_one or field.one_to_one):
+                break
+            path += name
+            if path not in related:
+                related.append(path)
+            current = field.related_model
+            if i == len(names) - 1:
+                # {{fk}} renders the related object's own label
+                nested = get_label_related(current, path + "__", depth - 1)
+                related += [rel for rel in nested if rel not in related]
+            path += "__"
+    return related
+
+
+def is_label_model(model):
+    return isinstance(model, type) and model.__str__ is LabelModel.__str__
+
+
+def select_label_related(queryset):
+    """
+    Apply select_related() for any relations used in the label template
+    """
+    if not isinstance(queryset, models.QuerySet):
+        return queryset
+    if queryset._result_cache is not None or queryset._fields is not None:
+        return queryset
+    if queryset.query.deferred_loading[0]:
+        return queryset
+    related = get_label_related(queryset.model)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset
+
+
+def render_labels(objs):
+    """
+    Render labels for a list or queryset of objects in a single pass
+    """
+    labels = []
+    for obj in select_label_related(objs):
+        if is_label_model(type(obj)):
+            template = get_label_template(obj.wq_label_template)
+            labels.append(LABEL_RENDERER.render(template, obj))
+        else:
+            labels.append(str(obj))
+    return labels
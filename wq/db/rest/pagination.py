@@ -1,20 +1,324 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import (
+    PageNumberPagination,
+    _get_displayed_page_numbers,
+    _get_page_links,
+)
 from collections import OrderedDict
+from functools import partial
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import (
+    replace_query_param,
+    remove_query_param,
+)
+from django.core.cache import cache
+from django.core.paginator import (
+    Paginator,
+    Page,
+    InvalidPage,
+    EmptyPage,
+    PageNotAnInteger,
+)
+from django.core.exceptions import (
+    EmptyResultSet,
+    FieldDoesNotExist,
+    ValidationError,
+)
+from django.db import connections
+from django.db import models
+from django.db.models import QuerySet, Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from .exceptions import ImproperlyConfigured
+from . import timing
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+import datetime
+import hashlib
+import json
+import uuid
+
+
+COUNT_VERSION_KEY = "wq-count-version:%s"
+COUNT_KEY = "wq-count:%s:%s:%s"
+
+
+def get_count_version(model):
+    key = COUNT_VERSION_KEY % model._meta.label_lower
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, None)
+    return version
+
+
+def invalidate_count(sender, **kwargs):
+    cache.delete(COUNT_VERSION_KEY % sender._meta.label_lower)
+
+
+class HasNextPage(Page):
+    def __init__(self, object_list, number, paginator):
+        self.next_exists = len(object_list) > paginator.per_page
+        super().__init__(object_list[: paginator.per_page], number, paginator)
+
+    def has_next(self):
+        return self.next_exists
+
+
+def validate_page_number(number):
+    """
+    Validate a page number without checking it against the page count
+    """
+    try:
+        if isinstance(number, float) and not number.is_integer():
+            raise ValueError
+        number = int(number)
+    except (TypeError, ValueError):
+        raise PageNotAnInteger(_("That page number is not an integer"))
+    if number < 1:
+        raise EmptyPage(_("That page number is less than 1"))
+    return number
+
+
+def get_next_row_page(paginator, number):
+    """
+    Fetch a page (plus one row to determine whether there is a next page)
+    without relying on the page count
+    """
+    number = paginator.validate_number(number)
+    bottom = (number - 1) * paginator.per_page
+    top = bottom + paginator.per_page + 1
+    object_list = list(paginator.object_list[bottom:top])
+    if not object_list and number > 1:
+        raise EmptyPage(_("That page contains no results"))
+    return HasNextPage(object_list, number, paginator)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Use the PostgreSQL planner's row estimate (pg_class.reltuples) for
+    unfiltered querysets on large tables, and COUNT(*) otherwise.  Since the
+    estimate may be low, pages past the estimated count are still served
+    (fetching one extra row to determine whether there is a next page).
+    """
+
+    min_estimate = 1000
+
+    @cached_property
+    def estimate(self):
+        estimate = self.get_estimate()
+        if estimate is not None and estimate >= self.min_estimate:
+            return estimate
+        return None
+
+    @cached_property
+    def count(self):
+        if self.estimate is not None:
+            return self.estimate
+        return super().count
+
+    def validate_number(self, number):
+        if self.estimate is None:
+            return super().validate_number(number)
+        return validate_page_number(number)
+
+    def page(self, number):
+        if self.estimate is None:
+            return super().page(number)
+        return get_next_row_page(self, number)
+
+    def get_estimate(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return None
+        query = queryset.query
+        if query.where or query.distinct or query.combinator:
+            return None
+        if query.is_sliced:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return int(row[0])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Cache counts per model & query, invalidated via post_save/post_delete
+    (see ModelRouter.register_config) or after timeout seconds.
+    """
+
+    timeout = 300
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        if timeout is not None:
+            self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        key = COUNT_KEY % (
+            queryset.model._meta.label_lower,
+            get_count_version(queryset.model),
+            hashlib.md5(repr((sql, params)).encode()).hexdigest(),
+        )
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, self.timeout)
+        return count
+
+
+class HasNextPaginator(Paginator):
+    """
+    Skip counting entirely, fetching one extra row to determine whether
+    there is a next page.
+    """
+
+    count = None
+    num_pages = None
+
+    def validate_number(self, number):
+        return validate_page_number(number)
+
+    def page(self, number):
+        return get_next_row_page(self, number)
+
+    def get_last_page(self):
+        # Only counted when the last page is explicitly requested
+        return Paginator(self.object_list, self.per_page).num_pages
 
 
 class Pagination(PageNumberPagination):
     page_size_query_param = "limit"
 
+    count_paginators = {
+        # None means use django_paginator_class
+        "exact": None,
+        "estimate": EstimatedCountPaginator,
+        "cached": CachedCountPaginator,
+        "has_next": HasNextPaginator,
+    }
+
     def paginate_queryset(self, queryset, request, view=None):
-        data = super(Pagination, self).paginate_queryset(
-            queryset, request, view
+        data = self.paginate_queryset_stream(queryset, request, view)
+        if data is None:
+            return None
+        return list(data)
+
+    def paginate_queryset_stream(self, queryset, request, view=None):
+        """
+        Variant of paginate_queryset() that leaves the page (or cached list)
+        unevaluated so it can be iterated in chunks.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator_class = self.get_paginator_class(queryset.model, view)
+        paginator = paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            with timing.phase("paginate"):
+                self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        if self.template is not None and self.is_multiple():
+            self.display_page_controls = True
+
+        cache = self.get_cache_mode(queryset.model, request, view)
+        cached = self.get_cache_queryset(queryset, cache, request, view)
+        if cached is None:
+            return self.page.object_list
+        return cached
+
+    def get_page_number(self, request, paginator):
+        page_number = request.query_params.get(self.page_query_param) or 1
+        if page_number in self.last_page_strings:
+            if paginator.num_pages is None:
+                page_number = paginator.get_last_page()
+            else:
+                page_number = paginator.num_pages
+        return page_number
+
+    def get_html_context(self):
+        if self.page.paginator.num_pages is not None:
+            return super().get_html_context()
+
+        # Without a page count, link up to the next page (if any)
+        base_url = self.request.build_absolute_uri()
+
+        def page_number_to_url(page_number):
+            if page_number == 1:
+                return remove_query_param(base_url, self.page_query_param)
+            else:
+                return replace_query_param(
+                    base_url, self.page_query_param, page_number
+                )
+
+        current = self.page.number
+        final = current + 1 if self.page.has_next() else current
+        page_numbers = _get_displayed_page_numbers(current, final)
+        return {
+            "previous_url": self.get_previous_link(),
+            "next_url": self.get_next_link(),
+            "page_links": _get_page_links(
+                page_numbers, current, page_number_to_url
+            ),
+        }
+
+    def get_paginator_class(self, model, view=None):
+        router = getattr(view, "router", None)
+        conf = (router and router.get_model_config(model)) or {}
+        strategy = conf.get("count", "exact")
+        if strategy not in self.count_paginators:
+            raise ImproperlyConfigured(
+                'Unknown count strategy "%s" for %s' % (strategy, model)
+            )
+        paginator_class = (
+            self.count_paginators[strategy] or self.django_paginator_class
         )
+        if strategy == "cached" and conf.get("count_timeout") is not None:
+            paginator_class = partial(
+                paginator_class, timeout=conf["count_timeout"]
+            )
+        return paginator_class
+
+    def is_multiple(self):
+        if self.page.paginator.num_pages is None:
+            return self.page.has_next() or self.page.has_previous()
+        return self.page.paginator.num_pages > 1
+
+    def get_cache_mode(self, model, request, view=None):
+        """
+        Determine the cache mode for an unfiltered JSON list request (or
+        None if the default pagination applies).
+        """
         if not view or not getattr(view, "router", None):
-            return data
+            return None
 
         if request.accepted_renderer.format != "json":
-            return data
+            return None
 
         non_format_kwargs = [
             kwarg
@@ -22,27 +326,35 @@ class Pagination(PageNumberPagination):
             if kwarg != "format"
         ]
         if view.action != "list" or any(non_format_kwargs):
-            return data
+            return None
 
-        conf = view.router.get_model_config(queryset.model)
-        cache = conf.get("cache", "first_page")
+        conf = view.router.get_model_config(model)
+        return conf.get("cache", "first_page")
 
-        if cache == "first_page":
-            return data
-        elif cache == "all":
-            return list(queryset)
+    def get_cache_queryset(self, queryset, cache, request, view=None):
+        if cache == "all":
+            return queryset
         elif cache == "none":
-            return []
+            return queryset.none()
         elif cache in ("filter", "autoupdate"):
+            if view.router.get_model_config(queryset.model).get("sync"):
+                # Read token first so concurrent changes are not missed
+                from .sync.models import get_sync_token
+
+                self.sync_token = get_sync_token()
             cache_filter = view.router.get_cache_filter_for_model(
                 queryset.model
             )
-            return list(cache_filter(queryset, self.request))
+            return cache_filter(queryset, request)
+        return None
 
-        return data
+    def add_sync_token(self, data):
+        sync_token = getattr(self, "sync_token", None)
+        if sync_token is not None:
+            data["sync_token"] = sync_token
 
     def get_paginated_response(self, data):
-        return Response(
+        response = Response(
             OrderedDict(
                 [
                     # DRF default metadata
@@ -53,9 +365,174 @@ class Pagination(PageNumberPagination):
                     ("page", self.page.number),
                     ("pages", self.page.paginator.num_pages),
                     ("per_page", self.page.paginator.per_page),
-                    ("multiple", self.page.paginator.num_pages > 1),
+                    ("multiple", self.is_multiple()),
                     # Actual data ('results' in DRF)
                     ("list", data),
                 ]
             )
         )
+        self.add_sync_token(response.data)
+        return response
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Keep full precision for dates and times (DjangoJSONEncoder truncates
+    them to milliseconds), so that cursor values match the boundary row.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(Pagination):
+    """
+    Pages on the queryset (or model) ordering plus the primary key, using
+    WHERE clauses instead of OFFSET so that deep pages are as cheap as the
+    first.  Ordering fields are assumed to be non-null.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset_stream(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        cache = self.get_cache_mode(queryset.model, request, view)
+        cached = self.get_cache_queryset(queryset, cache, request, view)
+        if cached is not None:
+            self.per_page = page_size
+            self.page_number = 1
+            self.next_values = None
+            return cached
+
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        self.per_page = page_size
+        self.page_number, values = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self.get_filter(values))
+
+        objs = list(queryset[: page_size + 1])
+        if len(objs) > page_size:
+            objs = objs[:page_size]
+            self.next_values = self.get_values(objs[-1])
+        else:
+            self.next_values = None
+        return objs
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        ordering = list(ordering)
+        for field in ordering:
+            if not isinstance(field, str) or field == "?":
+                raise ImproperlyConfigured(
+                    "Keyset pagination requires ordering by field names "
+                    "(%s)" % queryset.model
+                )
+        names = [field.lstrip("-") for field in ordering]
+        pk_name = queryset.model._meta.pk.name
+        if "pk" not in names and pk_name not in names:
+            ordering.append("pk")
+        return ordering
+
+    def get_filter(self, values):
+        # (a, b, pk) > (x, y, z) => a > x | a = x & b > y | ...
+        result = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip("-")
+            if values[i] is None:
+                continue
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = Q(**{"%s__%s" % (name, lookup): values[i]})
+            for prev, value in zip(self.ordering[:i], values[:i]):
+                condition &= Q(**{prev.lstrip("-"): value})
+            result |= condition
+        return result
+
+    def get_values(self, obj):
+        values = []
+        for field in self.ordering:
+            value = obj
+            for name in field.lstrip("-").split("__"):
+                value = getattr(value, name, None)
+            if isinstance(value, models.Model):
+                value = value.pk
+            values.append(value)
+        return values
+
+    def encode_cursor(self, page_number, values):
+        data = json.dumps([page_number, values], cls=CursorEncoder)
+        return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return 1, None
+        try:
+            cursor += "=" * (-len(cursor) % 4)
+            page_number, values = json.loads(urlsafe_b64decode(cursor))
+            if not isinstance(values, list):
+                raise ValueError
+            if len(values) != len(self.ordering):
+                raise ValueError
+            page_number = int(page_number)
+            values = [
+                self.to_python(field, value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return page_number, values
+
+    def to_python(self, ordering, value):
+        if value is None:
+            return None
+        model = self.model
+        field = None
+        try:
+            for name in ordering.lstrip("-").split("__"):
+                if field is not None:
+                    model = field.related_model
+                if name == "pk":
+                    field = model._meta.pk
+                else:
+                    field = model._meta.get_field(name)
+        except (FieldDoesNotExist, AttributeError):
+            # e.g. annotations
+            return value
+        if not hasattr(field, "to_python"):
+            return value
+        return field.to_python(value)
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.page_number + 1, self.next_values)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        response = Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    # wq.db additional metadata
+                    ("page", self.page_number),
+                    ("per_page", self.per_page),
+                    (
+                        "multiple",
+                        self.page_number > 1 or self.next_values is not None,
+                    ),
+                    ("list", data),
+                ]
+            )
+        )
+        self.add_sync_token(response.data)
+        return response
@@ -1,4 +1,7 @@
 from rest_framework.permissions import BasePermission
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_save, post_delete
+import uuid
 
 
 class ModelPermissions(BasePermission):
@@ -16,6 +19,11 @@ class ModelPermissions(BasePermission):
         if getattr(view, "model", None) is None:
             return True
         user = request.user
+        if getattr(view, "action", None) == "bulk":
+            # Add and change permissions are checked for each record
+            return has_perm(user, view.model, "add") or has_perm(
+                user, view.model, "change"
+            )
         method_perm = self.METHOD_PERM.get(
             request.method, self.METHOD_PERM["GET"]
         )
@@ -35,3 +43,59 @@ def has_perm(user, model, method_perm):
         from django.conf import settings
 
         return perm in getattr(settings, "ANONYMOUS_PERMISSIONS", {})
+
+
+PERM_VERSION_KEY = "wq-perm-version:%s"
+
+
+def get_perm_version(user):
+    """
+    Stamp that changes whenever the user's (or any group's) permissions do
+    """
+    keys = [PERM_VERSION_KEY % "all", PERM_VERSION_KEY % user.pk]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return ":".join(versions[key] for key in keys)
+
+
+def invalidate_perms(sender, instance=None, action=None, **kwargs):
+    from django.contrib.auth import get_user_model
+
+    if action and not action.startswith("post_"):
+        return
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    if isinstance(instance, get_user_model()):
+        cache.delete(PERM_VERSION_KEY % instance.pk)
+    else:
+        # Group changes (or reverse m2m updates) can affect many users
+        cache.delete(PERM_VERSION_KEY % "all")
+
+
+def connect_perm_signals():
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group
+
+    User = get_user_model()
+    through_models = [Group.permissions.through]
+    for name in "groups", "user_permissions":
+        field = getattr(User, name, None)
+        if field is not None:
+            through_models.append(field.through)
+    for through in through_models:
+        m2m_changed.connect(
+            invalidate_perms,
+            sender=through,
+            dispatch_uid="wq-perms-%s" % through._meta.label_lower,
+        )
+    for model in User, Group:
+        for signal in post_save, post_delete:
+            signal.connect(
+                invalidate_perms,
+                sender=model,
+                dispatch_uid="wq-perms-%s" % model._meta.label_lower,
+            )
@@ -1,6 +1,11 @@
-from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer
+from rest_framework.renderers import (
+    TemplateHTMLRenderer,
+    JSONRenderer as RestJSONRenderer,
+)
 from django.conf import settings
+from . import timing
 import re
+import uuid
 
 
 APP_TEMPLATES = {}
@@ -53,6 +58,61 @@ class HTMLRenderer(TemplateHTMLRenderer):
         return super().render(data, accepted_media_type, renderer_context)
 
 
+class JSONRenderer(RestJSONRenderer):
+    def render_stream(
+        self, data, objs, accepted_media_type=None, renderer_context=None
+    ):
+        """
+        Incrementally render data, encoding each object in objs as an item
+        of data["list"].  Output is identical to render().
+        """
+        renderer_context = renderer_context or {}
+        args = (accepted_media_type, renderer_context)
+        data = dict(data)
+
+        if self.get_indent(*args) is not None:
+            data["list"] = list(objs)
+            yield self.render(data, *args)
+            return
+
+        token = uuid.uuid4().hex
+        data["list"] = token
+        prefix, suffix = self.render(data, *args).split(
+            b'"' + token.encode() + b'"'
+        )
+        if self.compact:
+            separator = b","
+        else:
+            separator = b", "
+
+        yield prefix + b"["
+        first = True
+        for obj in objs:
+            yield (b"" if first else separator) + self.render(obj, *args)
+            first = False
+        yield b"]" + suffix
+
+
+class RawGeoJSON:
+    """
+    Pre-encoded GeoJSON geometry (e.g. from AsGeoJSON()), spliced directly
+    into the rendered output by GeoJSONRenderer.
+    """
+
+    __slots__ = ("geojson",)
+
+    def __init__(self, geojson):
+        self.geojson = geojson
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RawGeoJSON) and other.geojson == self.geojson
+        )
+
+    def __repr__(self):
+        return "RawGeoJSON(%r)" % self.geojson
+
+
 class ESMRenderer(JSONRenderer):
     media_type = "application/javascript"
     format = "js"
@@ -67,26 +127,91 @@ class GeoJSONRenderer(JSONRenderer):
     format = "geojson"
 
     def render(self, data, *args, **kwargs):
-        if isinstance(data, list):
-            features, simple = self.render_features(data)
-            data = {"type": "FeatureCollection", "features": features}
-        elif "list" in data and isinstance(data["list"], list):
-            features, simple = self.render_features(data["list"])
-            data["type"] = "FeatureCollection"
-            data["features"] = features
-            del data["list"]
+        with timing.phase("geojson"):
+            if isinstance(data, list):
+                features, simple = self.render_features(data)
+                data = {"type": "FeatureCollection", "features": features}
+            elif "list" in data and isinstance(data["list"], list):
+                features, simple = self.render_features(data["list"])
+                data["type"] = "FeatureCollection"
+                data["features"] = features
+                del data["list"]
+
+            else:
+                data, simple = self.render_feature(data)
+
+            if not simple and getattr(settings, "SRID", SRID) != SRID:
+                data["crs"] = self.get_crs()
 
+        if isinstance(data, dict) and "features" in data:
+            features = data["features"]
         else:
-            data, simple = self.render_feature(data)
-
-        if not simple and getattr(settings, "SRID", SRID) != SRID:
-            data["crs"] = {
-                "type": "name",
-                "properties": {
-                    "name": "urn:ogc:def:crs:EPSG::%s" % settings.SRID
-                },
-            }
-        return super().render(data, *args, **kwargs)
+            features = [data]
+        return self.encode(data, features, *args, **kwargs)
+
+    def render_stream(
+        self, data, objs, accepted_media_type=None, renderer_context=None
+    ):
+        """
+        Incrementally render a FeatureCollection, yielding the header (any
+        metadata in data), one encoded feature per object in objs, and then
+        the trailer.  Output is identical to render().
+        """
+        renderer_context = renderer_context or {}
+        args = (accepted_media_type, renderer_context)
+        data = dict(data or {})
+        data.pop("list", None)
+        data["type"] = "FeatureCollection"
+
+        if self.get_indent(*args) is not None or not self.compact:
+            data["list"] = list(objs)
+            yield self.render(data, *args)
+            return
+
+        yield self.encode(data, [], *args)[:-1] + b',"features":['
+        has_simple = False
+        first = True
+        for obj in objs:
+            with timing.phase("geojson"):
+                feature, simple = self.render_feature(obj)
+            if simple:
+                has_simple = True
+                if feature["geometry"]["coordinates"][0] is None:
+                    continue
+            yield (b"" if first else b",") + self.encode(
+                feature, [feature], *args
+            )
+            first = False
+
+        trailer = b"]"
+        if not has_simple and getattr(settings, "SRID", SRID) != SRID:
+            trailer += b',"crs":' + self.encode(self.get_crs(), [], *args)
+        yield trailer + b"}"
+
+    def get_crs(self):
+        return {
+            "type": "name",
+            "properties": {"name": "urn:ogc:def:crs:EPSG::%s" % settings.SRID},
+        }
+
+    def encode(self, data, features, *args, **kwargs):
+        raw = []
+        token = None
+        for feature in features:
+            geometry = feature.get("geometry")
+            if isinstance(geometry, RawGeoJSON):
+                token = token or uuid.uuid4().hex
+                feature["geometry"] = "%s:%s" % (token, len(raw))
+                raw.append(geometry.geojson.encode("utf-8"))
+
+        content = super().render(data, *args, **kwargs)
+        if raw:
+            content = re.sub(
+                b'"' + token.encode() + b':(\\d+)"',
+                lambda match: raw[int(match.group(1))],
+                content,
+            )
+        return content
 
     def render_feature(self, obj):
         feature = {"type": "Feature", "properties": obj}
@@ -106,7 +231,7 @@ class GeoJSONRenderer(JSONRenderer):
 
         else:
             for key, val in list(obj.items()):
-                if (
+                if isinstance(val, RawGeoJSON) or (
                     isinstance(val, dict)
                     and "type" in val
                     and ("coordinates" in val or "geometries" in val)
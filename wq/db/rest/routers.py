@@ -1,24 +1,66 @@
 from django.utils.encoding import force_str
+from django.utils.cache import get_conditional_response
 from django.urls import re_path, path
-
+from django.http import QueryDict
+from django.core.signals import got_request_exception
+from django.db import connections
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import copy
+import hashlib
+import json
+
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
 from rest_framework.routers import DefaultRouter, Route
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.urlpatterns import format_suffix_patterns
 from rest_framework.settings import api_settings
 from rest_framework.response import Response
+from rest_framework.utils import encoders
 
-from .permissions import has_perm
+from .permissions import has_perm, get_perm_version
 from .views import SimpleViewSet, ModelViewSet
 from .renderers import JSONRenderer, ESMRenderer
 from .exceptions import ImproperlyConfigured
+from .pagination import KeysetPagination, invalidate_count
+from . import timing
 from .maps import (
     tiles,
     update_tiles_url,
     update_geometry_fields,
     update_map_config,
+    supports_vector_tiles,
+    supports_db_geojson,
+    annotate_geojson,
+    get_model_geometry_fields,
+    invalidate_instance_tiles,
 )
 
 
+USER_CONFIG_KEY = "wq-user-config:%s:%s:%s"
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "currsize"])
+
+
+class EncodedResponse(Response):
+    """
+    Response with pre-rendered content (data is kept for reference)
+    """
+
+    def __init__(self, data, content, **kwargs):
+        super().__init__(data, **kwargs)
+        self.encoded_content = content
+
+    @property
+    def rendered_content(self):
+        self["Content-Type"] = self.content_type
+        return self.encoded_content
+
+
 class ModelRouter(DefaultRouter):
     _models = set()
     _serializers = {}
@@ -41,6 +83,7 @@ class ModelRouter(DefaultRouter):
     include_tiles_view = True
 
     default_serializer_class = None
+    cache_default_serializer_fields = True
 
     def __init__(self, trailing_slash=False):
         # Add trailing slash for HTML list views
@@ -54,6 +97,16 @@ class ModelRouter(DefaultRouter):
             )
         )
         super(ModelRouter, self).__init__(trailing_slash=trailing_slash)
+        self._serializer_classes = {}
+        self._serializer_cache_hits = 0
+        self._serializer_cache_misses = 0
+        self._query_plans = {}
+        self._field_cache_serializers = set()
+        self._viewset_classes = {}
+        self._encoded_config = {}
+        self._page_configs = {}
+        self._page_maps = {}
+        self._wq_config_memo = None
 
     def register(self, model, *args, **kwargs):
         if isinstance(model, type) and not args:
@@ -130,13 +183,18 @@ class ModelRouter(DefaultRouter):
 
     def register_viewset(self, model, viewset):
         self._viewsets[model] = viewset
+        self._viewset_classes.clear()
 
     def register_serializer(self, model, serializer):
         self._serializers[model] = serializer
-        self._base_config = None
+        self.clear_serializer_cache()
+        self._viewset_classes.clear()
+        self.invalidate_page_config(model)
 
     def register_fields(self, model, fields):
         self._fields[model] = fields
+        self.clear_serializer_cache()
+        self.invalidate_page_config(model)
 
     def register_queryset(self, model, queryset):
         self._querysets[model] = queryset
@@ -154,7 +212,10 @@ class ModelRouter(DefaultRouter):
                     '"%s" is deprecated in favor of "cache"' % key
                 )
         self._config[model] = config
-        self._base_config = None
+        self.register_signals(model, config)
+        self.clear_serializer_cache()
+        self._viewset_classes.clear()
+        self.invalidate_page_config(model)
 
     def update_config(self, model, **kwargs):
         if model not in self._config:
@@ -165,7 +226,83 @@ class ModelRouter(DefaultRouter):
                     '"%s" is deprecated in favor of "cache"' % key
                 )
         self._config[model].update(kwargs)
+        self.register_signals(model, self._config[model])
+        self.clear_serializer_cache()
+        self._viewset_classes.clear()
+        self.invalidate_page_config(model)
+
+    def register_signals(self, model, config):
+        if not isinstance(model, type):
+            return
+        if config.get("sync"):
+            if not apps.is_installed("wq.db.rest.sync"):
+                raise ImproperlyConfigured(
+                    "Add wq.db.rest.sync to INSTALLED_APPS to use sync=True"
+                )
+            if config.get("cache") not in ("filter", "autoupdate"):
+                raise ImproperlyConfigured(
+                    'sync=True requires cache="filter" or cache="autoupdate"'
+                    " (%s)" % model
+                )
+        uid = model._meta.label_lower
+        has_tiles = supports_vector_tiles() and get_model_geometry_fields(
+            model
+        )
+        for signal in post_save, post_delete:
+            if config.get("count") == "cached":
+                signal.connect(
+                    invalidate_count,
+                    sender=model,
+                    weak=False,
+                    dispatch_uid="wq-count-%s" % uid,
+                )
+            if config.get("sync"):
+                signal.connect(
+                    self.record_change,
+                    sender=model,
+                    weak=False,
+                    dispatch_uid="wq-change-%s" % uid,
+                )
+            if has_tiles:
+                signal.connect(
+                    invalidate_instance_tiles,
+                    sender=model,
+                    weak=False,
+                    dispatch_uid="wq-tiles-%s" % uid,
+                )
+
+    def record_change(self, sender, instance, signal, **kwargs):
+        from .sync.models import record_change
+
+        record_change(
+            sender,
+            self.get_object_id(instance),
+            deleted=(signal is post_delete),
+        )
+
+    def invalidate_page_config(self, model=None, depth=2):
+        """
+        Mark the page config for model (and for any models related to it,
+        whose forms may reference it) as needing to be rebuilt.  If no model
+        is given, all pages will be rebuilt.  Use this rather than resetting
+        _base_config directly, which only rebuilds the top-level config and
+        keeps serving the cached page configs and map layers.
+        """
         self._base_config = None
+        if model is None:
+            self._page_configs.clear()
+            self._page_maps.clear()
+            return
+        models = {model}
+        for i in range(depth):
+            models |= {
+                field.related_model
+                for other in models
+                for field in other._meta.get_fields()
+                if isinstance(field.related_model, type)
+            }
+        for other in models:
+            self._page_configs.pop(other, None)
 
     def set_extra_config(self, **extra):
         self._extra_config.update(extra)
@@ -190,9 +327,31 @@ class ModelRouter(DefaultRouter):
                 return default(real_model)
 
     def get_serializer_for_model(self, model_class, serializer_depth=None):
+        key = (model_class, serializer_depth)
+        serializer = self._serializer_classes.get(key)
+        if serializer is not None:
+            self._serializer_cache_hits += 1
+            return serializer
+
+        self._serializer_cache_misses += 1
+        serializer = self.build_serializer_for_model(
+            model_class, serializer_depth
+        )
+        self._serializer_classes[key] = serializer
+        return serializer
+
+    def build_serializer_for_model(self, model_class, serializer_depth=None):
         serializer = self.get_class(
             self._serializers, model_class, self.get_default_serializer_class
         )
+        # The default serializer's fields only vary by the flags in its
+        # field cache key, so they can be reused across requests.  Custom
+        # serializers (and subclasses of the generated class) opt in by
+        # setting cache_fields themselves.
+        cache_fields = (
+            self.cache_default_serializer_fields
+            and serializer is self.get_default_serializer_class()
+        )
 
         meta = getattr(serializer, "Meta", object)
         if not getattr(meta, "model", None):
@@ -210,6 +369,8 @@ class ModelRouter(DefaultRouter):
                 serializer_depth=serializer_depth,
                 nested_arrays=self._nested_arrays.get(model_class),
             )
+            if cache_fields:
+                self._field_cache_serializers.add(serializer)
 
         meta = getattr(serializer, "Meta", object)
         conf = self._config.get(model_class, None)
@@ -224,6 +385,24 @@ class ModelRouter(DefaultRouter):
 
         return serializer
 
+    def clear_serializer_cache(self):
+        from .serializers import ModelSerializer
+
+        self._serializer_classes.clear()
+        self._query_plans.clear()
+        self._field_cache_serializers.clear()
+        ModelSerializer.clear_field_cache()
+
+    def serializer_caches_fields(self, serializer_class):
+        return serializer_class in self._field_cache_serializers
+
+    def serializer_cache_info(self):
+        return CacheInfo(
+            self._serializer_cache_hits,
+            self._serializer_cache_misses,
+            len(self._serializer_classes),
+        )
+
     def serialize(self, obj, many=False, depth=None, request=None):
         if many:
             # assume obj is a queryset
@@ -257,15 +436,36 @@ class ModelRouter(DefaultRouter):
             return paginate_by
         return api_settings.PAGE_SIZE
 
+    def get_pagination_class_for_model(self, model_class):
+        config = self.get_model_config(model_class) or {}
+        pagination = config.get("pagination", None)
+        if pagination == "keyset":
+            return KeysetPagination
+        elif pagination:
+            raise ImproperlyConfigured(
+                'Unknown pagination mode "%s" for %s'
+                % (pagination, model_class)
+            )
+        return None
+
     def paginate(self, model, page_num, request):
-        # FIXME: should copy() before modifying but doing so causes recursion
-        request.GET = {
-            "page": page_num,
-        }
         view = self.get_viewset_for_model(model).as_view(
             actions={"get": "list"},
         )
-        return view(request._request).data
+        return view(self.clone_request(request, page=page_num)).data
+
+    def clone_request(self, request, **params):
+        """
+        Copy the underlying HttpRequest with a new query string, leaving the
+        original request (and any other clones) untouched.
+        """
+        request = getattr(request, "_request", request)
+        clone = copy.copy(request)
+        clone.GET = QueryDict(mutable=True)
+        for key, value in params.items():
+            clone.GET[key] = str(value)
+        clone.META = {**request.META, "QUERY_STRING": clone.GET.urlencode()}
+        return clone
 
     def get_queryset_for_model(self, model, request=None):
         if model in self._page_models:
@@ -292,8 +492,54 @@ class ModelRouter(DefaultRouter):
                         if "." not in field["name"]
                     ]
                 )
+            elif (
+                config.get("db_geojson")
+                and config.get("geometry_fields")
+                and renderer
+                and renderer.format == "geojson"
+                and request.method in SAFE_METHODS
+                and supports_db_geojson()
+            ):
+                # (Not for writes, as the annotation would be out of date
+                # by the time the saved instance is serialized)
+                qs = annotate_geojson(
+                    qs,
+                    [field["name"] for field in config["geometry_fields"]],
+                )
         return qs
 
+    def optimize_queryset(
+        self, queryset, serializer_class, context=None, only=False, depth=None
+    ):
+        """
+        Apply the serializer's query plan to queryset.  Plans are computed
+        once per serializer class, list/detail mode, depth and renderer
+        format, and discarded along with the serializer cache.
+        """
+        from .serializers import apply_query_plan
+
+        config = self.get_model_config(queryset.model) or {}
+        if not config.get("optimize_queryset", True):
+            return queryset
+        if not hasattr(serializer_class, "get_query_plan"):
+            return queryset
+        context = context or {}
+        if only and queryset.query.deferred_loading[0]:
+            only = False
+        renderer = getattr(context.get("request"), "accepted_renderer", None)
+        key = (
+            serializer_class,
+            bool(only),
+            depth,
+            getattr(renderer, "format", None),
+        )
+        plan = self._query_plans.get(key)
+        if plan is None:
+            serializer = serializer_class(context=context)
+            plan = serializer.get_query_plan(bool(only))
+            self._query_plans[key] = plan
+        return apply_query_plan(queryset, copy.deepcopy(plan))
+
     def get_cache_filter_for_model(self, model):
         return self._cache_filters.get(model, lambda qs, req: qs.none())
 
@@ -304,19 +550,29 @@ class ModelRouter(DefaultRouter):
     def get_viewset_for_model(self, model_class):
         if model_class in self._page_models:
             model_class = self._page_models[model_class]
+        if model_class not in self._viewset_classes:
+            self._viewset_classes[model_class] = self.build_viewset_for_model(
+                model_class
+            )
+        return self._viewset_classes[model_class]
+
+    def build_viewset_for_model(self, model_class):
         viewset = self.get_class(
             self._viewsets, model_class, lambda d: ModelViewSet
         )
         lookup = self.get_lookup_for_model(model_class)
 
         per_page = self.get_paginate_by_for_model(model_class)
+        pagination = self.get_pagination_class_for_model(model_class)
         if per_page != api_settings.PAGE_SIZE:
 
-            class CustomPagination(api_settings.DEFAULT_PAGINATION_CLASS):
+            class CustomPagination(
+                pagination or api_settings.DEFAULT_PAGINATION_CLASS
+            ):
                 page_size = per_page
 
         else:
-            CustomPagination = None
+            CustomPagination = pagination
 
         class ViewSet(viewset):
             model = model_class
@@ -338,32 +594,22 @@ class ModelRouter(DefaultRouter):
         if self._base_config:
             return self._base_config
 
-        from django.contrib.auth.models import AnonymousUser
-
-        user = AnonymousUser()
         pages = {}
         for page in self._extra_pages:
             conf, view = self.get_page(page)
             pages[page] = conf.copy()
-        for model in self._models:
-            if not has_perm(user, model, "view"):
-                continue
-
-            info = self._config[model].copy()
-            info["list"] = True
-            for perm in ("add", "change", "delete"):
-                if has_perm(user, model, perm):
-                    info["can_" + perm] = True
 
-            serializer = self.get_serializer_for_model(model)
-            if not hasattr(serializer, "get_wq_config"):
-                raise Exception(model)
-            conf = serializer(context={"router": self}).get_wq_config()
-            for key in conf:
-                if key not in info:
-                    info[key] = conf[key]
-
-            pages[info["name"]] = info
+        # Share serializer configs (e.g. nested arrays) within this build
+        self._wq_config_memo = {}
+        try:
+            for model in self._models:
+                if model not in self._page_configs:
+                    self._page_configs[model] = self.build_page_config(model)
+                info = self._page_configs[model]
+                if info is not None:
+                    pages[info["name"]] = info.copy()
+        finally:
+            self._wq_config_memo = None
 
         site_title = getattr(settings, "PROJECT_NAME", None)
         base_url = self.get_base_url()
@@ -383,8 +629,7 @@ class ModelRouter(DefaultRouter):
         for conf in pages.values():
             update_geometry_fields(conf)
 
-        for conf in pages.values():
-            update_map_config(conf, pages)
+        self.update_map_layers(pages)
 
         self._base_config = {
             "pages": pages,
@@ -405,24 +650,113 @@ class ModelRouter(DefaultRouter):
         self._base_config.update(self._extra_config)
         return self._base_config
 
+    def build_page_config(self, model):
+        from django.contrib.auth.models import AnonymousUser
+
+        user = AnonymousUser()
+        if not has_perm(user, model, "view"):
+            return None
+
+        info = self._config[model].copy()
+        info["list"] = True
+        for perm in ("add", "change", "delete"):
+            if has_perm(user, model, perm):
+                info["can_" + perm] = True
+
+        serializer = self.get_serializer_for_model(model)
+        if not hasattr(serializer, "get_wq_config"):
+            raise Exception(model)
+        conf = serializer(context={"router": self}).get_wq_config()
+        for key in conf:
+            if key not in info:
+                info[key] = conf[key]
+
+        update_geometry_fields(info)
+        return info
+
+    def update_map_layers(self, pages):
+        """
+        Compute map layers, reusing the previous result for each page unless
+        the page itself (or, with vector tiles, any geometry page) changed.
+        """
+        if supports_vector_tiles():
+            geometry_pages = [
+                (name, dict(conf))
+                for name, conf in sorted(pages.items())
+                if conf.get("geometry_fields")
+            ]
+        else:
+            geometry_pages = []
+
+        for name, conf in pages.items():
+            if not conf.get("map"):
+                continue
+            source = dict(conf)
+            cached = self._page_maps.get(name)
+            if cached and cached[0] == source and cached[1] == geometry_pages:
+                conf["map"] = cached[2]
+                continue
+            conf["map"] = copy.deepcopy(conf["map"])
+            update_map_config(conf, pages)
+            self._page_maps[name] = (source, geometry_pages, conf["map"])
+
     @property
     def config(self):
         return self.base_config
 
     def get_user_config(self, user):
+        return self.get_user_config_info(user)[0]
+
+    def get_user_config_hash(self, user):
+        return self.get_user_config_info(user)[1]
+
+    def get_user_config_info(self, user):
+        """
+        Return (config, hash) with user-specific permissions.  Results for
+        authenticated users are cached until the config, the user's groups
+        or permissions, or any group permissions change.
+        """
+        pages, pages_hash = self.get_cached_encoding(
+            "user_pages", self.get_user_config_pages
+        )
+        if user.is_authenticated:
+            key = USER_CONFIG_KEY % (
+                user.pk,
+                get_perm_version(user),
+                pages_hash,
+            )
+            result = cache.get(key)
+            if result is None:
+                result = self.build_user_config(user, pages)
+                cache.set(key, result, None)
+            return result
+        return self.build_user_config(user, pages)
+
+    def get_user_config_pages(self, config):
+        pages = [
+            (page, self._page_models[page])
+            for page, info in config["pages"].items()
+            if info.get("list", False)
+        ]
+        pages_hash = hashlib.md5(
+            repr([(page, model._meta.label) for page, model in pages]).encode()
+        ).hexdigest()
+        return pages, pages_hash
+
+    def build_user_config(self, user, pages):
         # Add user-specific permissions to configuration
         config = {"pages": {}}
-        for page, info in self.config["pages"].items():
-            if not info.get("list", False):
-                continue
-            model = self._page_models[page]
+        for page, model in pages:
             perms = {}
             for perm in ("add", "change", "delete"):
                 if has_perm(user, model, perm):
                     perms["can_" + perm] = True
             config["pages"][page] = perms
 
-        return config
+        config_hash = hashlib.md5(
+            json.dumps(config, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        return config, config_hash
 
     def add_page(self, name, config, view=None):
         if view is None:
@@ -484,10 +818,74 @@ class ModelRouter(DefaultRouter):
             renderer_classes = [JSONRenderer, ESMRenderer]
 
             def list(this, request, *args, **kwargs):
-                return Response(self.config)
+                return self.get_config_response(request)
 
         return ConfigView
 
+    def get_config_response(self, request):
+        """
+        Serve the pre-encoded config with an ETag for conditional GETs.
+        Clients revalidate on every load unless WQ_CONFIG_MAX_AGE is set.
+        """
+        content, etag = self.get_encoded_config(
+            request.accepted_renderer, request.accepted_media_type
+        )
+        response = EncodedResponse(
+            self.config,
+            content=content,
+            content_type=request.accepted_renderer.media_type,
+        )
+        response["ETag"] = etag
+        max_age = getattr(settings, "WQ_CONFIG_MAX_AGE", 0)
+        if max_age and not settings.DEBUG:
+            response["Cache-Control"] = "public, max-age=%s" % max_age
+        else:
+            response["Cache-Control"] = "no-cache"
+        return get_conditional_response(
+            request, etag=etag, response=response
+        )
+
+    def get_encoded_config(self, renderer, accepted_media_type=None):
+        """
+        Return (content, etag) for the rendered config
+        """
+
+        def encode(config):
+            content = renderer.render(config, accepted_media_type)
+            etag = '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+            return content, etag
+
+        key = (type(renderer), accepted_media_type)
+        return self.get_cached_encoding(key, encode)
+
+    def get_config_text(self, format="json"):
+        """
+        Return the indented config text written by dump_config
+        """
+
+        def encode(config):
+            text = json.dumps(config, cls=encoders.JSONEncoder, indent=4)
+            if format == "esm":
+                text = "const config = %s;\nexport default config;" % text
+            elif format == "amd":
+                text = "define(%s);" % text
+            return text
+
+        return self.get_cached_encoding(("text", format), encode)
+
+    def get_cached_encoding(self, key, encode):
+        """
+        Encoded payloads are kept alongside the config they were generated
+        from, and discarded whenever the config is regenerated (i.e. after
+        invalidate_page_config() is called).
+        """
+        config = self.config
+        if self._encoded_config.get("config") is not config:
+            self._encoded_config = {"config": config}
+        if key not in self._encoded_config:
+            self._encoded_config[key] = encode(config)
+        return self._encoded_config[key]
+
     def get_index_view(self):
         class IndexView(SimpleViewSet):
             def list(this, request, *args, **kwargs):
@@ -508,14 +906,55 @@ class ModelRouter(DefaultRouter):
             conf["url"]: (page, conf)
             for page, conf in self.config["pages"].items()
         }
-        result = {}
+        lists = []
         for listurl in urls:
-            if listurl not in conf_by_url:
-                continue
+            if listurl in conf_by_url and listurl not in lists:
+                lists.append(listurl)
+
+        def fetch(listurl):
             page, conf = conf_by_url[listurl]
-            model = self._page_models[page]
-            result[listurl] = self.paginate(model, 1, request)
-        return Response(result)
+            return self.get_multi_list(self._page_models[page], request)
+
+        def fetch_threaded(listurl):
+            try:
+                with timing.worker():
+                    return fetch(listurl)
+            finally:
+                # Each worker thread has its own database connection
+                connections.close_all()
+
+        max_workers = getattr(settings, "WQ_MULTI_MAX_WORKERS", None)
+        if max_workers and len(lists) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(lists))
+            ) as executor:
+                # Run each list in a copy of the current context (so that
+                # any request timer is shared with the worker threads)
+                results = list(
+                    executor.map(
+                        lambda context, listurl: context.run(
+                            fetch_threaded, listurl
+                        ),
+                        [copy_context() for listurl in lists],
+                        lists,
+                    )
+                )
+        else:
+            results = [fetch(listurl) for listurl in lists]
+        return Response(dict(zip(lists, results)))
+
+    def get_multi_list(self, model, request):
+        """
+        Fetch the first page of a list for multi.json.  Unexpected errors
+        are reported (via got_request_exception) without affecting the
+        other lists in the response.
+        """
+        try:
+            return self.paginate(model, 1, request)
+        except Exception:
+            request = getattr(request, "_request", request)
+            got_request_exception.send(sender=type(self), request=request)
+            return {"detail": "Server Error (500)"}
 
     def tiles(self, request, z, x, y):
         return tiles(self, request, z, x, y)
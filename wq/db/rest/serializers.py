@@ -9,9 +9,14 @@ except (OSError, ImproperlyConfigured):
 
     GEOSGeometry = None
 
+from django.db import models, transaction, connections
+from django.db import router as db_router
+from django.db.models.signals import pre_save, post_save
 from django.utils import timezone
 from django.core.exceptions import FieldDoesNotExist
 from collections import OrderedDict
+import contextlib
+import copy
 
 from django.conf import settings
 
@@ -23,12 +28,34 @@ from natural_keys.serializers import (
 )
 from drf_writable_nested import WritableNestedModelSerializer
 from .exceptions import ImproperlyConfigured
+from .maps import get_geojson_annotation
+from .renderers import RawGeoJSON
+from . import timing
+from .models import (
+    select_label_related,
+    render_labels,
+    get_label_related,
+    get_label_template,
+    get_template_keys,
+    is_label_model,
+)
 
 
 class GeometryField(serializers.Field):
+    def get_attribute(self, instance):
+        # Use AsGeoJSON() annotation if present (see maps.annotate_geojson)
+        if len(self.source_attrs) == 1:
+            name = get_geojson_annotation(self.source)
+            if name in getattr(instance, "__dict__", {}):
+                geojson = instance.__dict__[name]
+                return RawGeoJSON(geojson) if geojson else None
+        return super().get_attribute(instance)
+
     def to_representation(self, value):
         if value is None:
             return None
+        if isinstance(value, RawGeoJSON):
+            return value
         import json
 
         return json.loads(value.geojson)
@@ -93,6 +120,18 @@ class LookupRelatedField(serializers.SlugRelatedField):
         return value
 
 
+class LabelField(serializers.ReadOnlyField):
+    def __init__(self, **kwargs):
+        kwargs.setdefault("source", "__str__")
+        super().__init__(**kwargs)
+        self.labels = {}
+
+    def get_attribute(self, instance):
+        if id(instance) in self.labels:
+            return self.labels[id(instance)]
+        return super().get_attribute(instance)
+
+
 class LocalDateTimeField(serializers.ReadOnlyField):
     def to_representation(self, value):
         if value is None:
@@ -170,6 +209,30 @@ def get_choice_list(choices, group=None):
     return choice_list
 
 
+def get_field_mapping(mapping):
+    mapping = mapping.copy()
+    mapping[model_fields.FileField] = ClearableFileField
+    mapping[model_fields.ImageField] = ClearableImageField
+
+    for model_field, serializer_field in list(mapping.items()):
+        if serializer_field == serializers.CharField:
+            mapping[model_field] = BlankCharField
+
+    if GEOSGeometry:
+        for field in (
+            "Geometry",
+            "GeometryCollection",
+            "Point",
+            "LineString",
+            "Polygon",
+            "MultiPoint",
+            "MultiLineString",
+            "MultiPolygon",
+        ):
+            mapping[getattr(model_fields, field + "Field")] = GeometryField
+    return mapping
+
+
 class ListSerializer(serializers.ListSerializer):
     @property
     def type_field(self):
@@ -207,13 +270,70 @@ class ListSerializer(serializers.ListSerializer):
             value = [row for row in value if not self.skip_empty(row)]
         return value
 
+    def create(self, validated_data):
+        # Resolve natural keys for all rows at once
+        if hasattr(self.child, "convert_natural_keys_many"):
+            self.child.convert_natural_keys_many(validated_data)
+        model_class = self.child.Meta.model
+        if (
+            type(self.child).create is ModelSerializer.create
+            and model_class.save is models.Model.save
+            and can_bulk_insert(self.child)
+        ):
+            return self.bulk_create(validated_data)
+        return super().create(validated_data)
+
+    def bulk_create(self, validated_data):
+        """
+        Insert all rows with a single bulk_create().  Only used when neither
+        the model's save() nor the serializer's create() is overridden;
+        pre_save and post_save are sent for each row as they would be by
+        save().
+        """
+        model_class = self.child.Meta.model
+        db = db_router.db_for_write(model_class)
+        objs = [model_class(**attrs) for attrs in validated_data]
+        signal_kwargs = {"raw": False, "using": db, "update_fields": None}
+        with transaction.atomic(using=db):
+            for obj in objs:
+                pre_save.send(model_class, instance=obj, **signal_kwargs)
+            model_class._default_manager.db_manager(db).bulk_create(objs)
+            for obj in objs:
+                post_save.send(
+                    model_class, instance=obj, created=True, **signal_kwargs
+                )
+        return objs
+
+    def to_representation(self, data):
+        label_field = self.child.fields.get("label")
+        if not isinstance(label_field, LabelField):
+            return super().to_representation(data)
+
+        if isinstance(data, models.manager.BaseManager):
+            data = data.all()
+        objs = list(select_label_related(data))
+        with timing.phase("labels"):
+            labels = render_labels(objs)
+        label_field.labels = {
+            id(obj): label for obj, label in zip(objs, labels)
+        }
+        try:
+            return [self.child.to_representation(obj) for obj in objs]
+        finally:
+            label_field.labels = {}
+
 
 class ModelSerializer(
     NaturalKeyModelSerializer,
     WritableNestedModelSerializer,
 ):
     add_label_fields = True
+    cache_fields = False
+    _field_cache = {}
 
+    serializer_field_mapping = get_field_mapping(
+        serializers.ModelSerializer.serializer_field_mapping
+    )
     serializer_related_field = LookupRelatedField
     serializer_related_to_field = LookupRelatedField
 
@@ -235,30 +355,11 @@ class ModelSerializer(
     )
 
     def __init__(self, *args, wq_config=None, **kwargs):
-        mapping = self.serializer_field_mapping
-        mapping[model_fields.FileField] = ClearableFileField
-        mapping[model_fields.ImageField] = ClearableImageField
-
-        for model_field, serializer_field in list(mapping.items()):
-            if serializer_field == serializers.CharField:
-                mapping[model_field] = BlankCharField
-
-        if GEOSGeometry:
-            for field in (
-                "Geometry",
-                "GeometryCollection",
-                "Point",
-                "LineString",
-                "Polygon",
-                "MultiPoint",
-                "MultiLineString",
-                "MultiPolygon",
-            ):
-                mapping[getattr(model_fields, field + "Field")] = GeometryField
         if wq_config:
             self.wq_config = wq_config
         super().__init__(*args, **kwargs)
-        if getattr(self, "initial_data", None):
+        initial_data = getattr(self, "initial_data", None)
+        if initial_data and not isinstance(initial_data, list):
             self.initial_data = parse_json_form(self.initial_data)
         self.id_fields = set()
 
@@ -270,13 +371,192 @@ class ModelSerializer(
 
     def create(self, validated_data):
         self.convert_natural_keys(validated_data)
-        return WritableNestedModelSerializer.create(self, validated_data)
+        with self.get_write_context():
+            return WritableNestedModelSerializer.create(self, validated_data)
 
     def update(self, instance, validated_data):
         self.convert_natural_keys(validated_data)
-        return WritableNestedModelSerializer.update(
-            self, instance, validated_data
+        with self.get_write_context():
+            return WritableNestedModelSerializer.update(
+                self, instance, validated_data
+            )
+
+    def convert_natural_keys(self, validated_data):
+        self.convert_natural_keys_many([validated_data])
+
+    def convert_natural_keys_many(self, rows):
+        """
+        Replace natural key values with (existing or new) objects, resolving
+        each model's keys in bulk.  Keys in nested arrays are resolved up
+        front as well, so that the rows' own saves hit the cache.
+        """
+        cache = self.get_natural_key_cache()
+        for name, field in self.fields.items():
+            if isinstance(field, NaturalKeySerializer):
+                model_class = field.Meta.model
+                matched = [
+                    row
+                    for row in rows
+                    if isinstance(row.get(name), (dict, OrderedDict))
+                ]
+                keys = [
+                    get_natural_key(model_class, row[name]) for row in matched
+                ]
+                objs = resolve_natural_keys(model_class, keys, cache)
+                for row, obj in zip(matched, objs):
+                    if obj is None:
+                        raise serializers.ValidationError(
+                            {name: "Could not resolve natural key."}
+                        )
+                    row[name] = obj
+            elif isinstance(field, serializers.ListSerializer) and hasattr(
+                field.child, "convert_natural_keys_many"
+            ):
+                nested_rows = [
+                    dict(nested_row)
+                    for row in rows
+                    for nested_row in row.get(field.source) or []
+                    if isinstance(nested_row, dict)
+                ]
+                if nested_rows:
+                    field.child.convert_natural_keys_many(nested_rows)
+
+    def _extract_relations(self, validated_data):
+        # Natural keys were already resolved by convert_natural_keys(), so
+        # they don't need to be saved again as direct relations
+        resolved = {
+            name: validated_data[name]
+            for name, field in self.fields.items()
+            if isinstance(field, NaturalKeySerializer)
+            and isinstance(validated_data.get(name), models.Model)
+        }
+        relations, reverse_relations = super()._extract_relations(
+            validated_data
         )
+        for name in resolved:
+            relations.pop(name, None)
+        validated_data.update(resolved)
+        return relations, reverse_relations
+
+    def get_natural_key_cache(self):
+        # Serializer context is shared by nested serializers and is
+        # recreated for every request
+        return self.context.setdefault("natural_keys", {})
+
+    def get_write_context(self):
+        if getattr(self.Meta, "wq_bulk_nested_arrays", False):
+            return transaction.atomic()
+        return contextlib.nullcontext()
+
+    def update_or_create_reverse_relations(self, instance, reverse_relations):
+        if not getattr(self.Meta, "wq_bulk_nested_arrays", False):
+            return super().update_or_create_reverse_relations(
+                instance, reverse_relations
+            )
+        bulk_relations = OrderedDict()
+        other_relations = OrderedDict()
+        for field_name, relation in reverse_relations.items():
+            if self.can_bulk_write(*relation):
+                bulk_relations[field_name] = relation
+            else:
+                other_relations[field_name] = relation
+        super().update_or_create_reverse_relations(instance, other_relations)
+        for field_name, relation in bulk_relations.items():
+            self.bulk_write_reverse_relation(instance, field_name, *relation)
+
+    def can_bulk_write(self, related_field, field, field_source):
+        """
+        Nested arrays can be written in bulk if every writable field maps to
+        a concrete column on the array model (i.e. no further nesting), and
+        the database returns primary keys from bulk inserts.
+        """
+        if related_field.many_to_many or related_field.one_to_one:
+            return False
+        if not isinstance(related_field, models.ForeignKey):
+            return False
+        return can_bulk_insert(field)
+
+    def bulk_write_reverse_relation(
+        self, instance, field_name, related_field, field, field_source
+    ):
+        """
+        Validate each row as usual, then save the whole array with
+        bulk_create() and bulk_update().  Rows are matched to existing
+        records by pk or (for natural key models) by natural key.  Note that
+        save() and model signals are bypassed for array rows.
+        """
+        related_data = self.get_initial().get(field_name, None)
+        if related_data is None:
+            return
+
+        model_class = field.Meta.model
+        pks = self._extract_related_pks(field, related_data)
+        existing = model_class._default_manager.filter(
+            models.Q(pk__in=pks) | models.Q(**{related_field.name: instance})
+        )
+        by_pk = {str(obj.pk): obj for obj in existing}
+        by_key = {}
+        key_fields = self.get_natural_key_fields(model_class)
+        if key_fields:
+            for obj in by_pk.values():
+                if getattr(obj, related_field.attname) == instance.pk:
+                    key = tuple(getattr(obj, f.attname) for f in key_fields)
+                    by_key[key] = obj
+
+        save_kwargs = {
+            **self._get_save_kwargs(field_name),
+            related_field.name: instance,
+        }
+        rows = []
+        errors = []
+        for data in related_data:
+            obj = by_pk.get(self._get_related_pk(data, model_class))
+            serializer = self._get_serializer_for_field(
+                field, instance=obj, data=data
+            )
+            try:
+                serializer.is_valid(raise_exception=True)
+                errors.append({})
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+                continue
+            attrs = {**serializer.validated_data, **save_kwargs}
+            rows.append((data, obj, attrs))
+
+        if any(errors):
+            raise serializers.ValidationError({field_name: errors})
+
+        if hasattr(field, "convert_natural_keys_many"):
+            field.convert_natural_keys_many([attrs for *_, attrs in rows])
+        if key_fields:
+            for i, (data, obj, attrs) in enumerate(rows):
+                if obj is None:
+                    key = tuple(
+                        get_attname_value(attrs, f) for f in key_fields
+                    )
+                    rows[i] = (data, by_key.get(key), attrs)
+
+        created = []
+        updated = []
+        update_fields = set()
+        for i, (data, obj, attrs) in enumerate(rows):
+            if obj is None:
+                obj = model_class(**attrs)
+                created.append(obj)
+            else:
+                for name, value in attrs.items():
+                    setattr(obj, name, value)
+                    update_fields.add(name)
+                updated.append(obj)
+            rows[i] = (data, obj)
+        if created:
+            model_class._default_manager.bulk_create(created)
+        if updated and update_fields:
+            model_class._default_manager.bulk_update(updated, update_fields)
+
+        # Saved rows are kept by delete_reverse_relations_if_need()
+        for data, obj in rows:
+            data["pk"] = obj.pk
 
     def get_fields_for_config(self):
         self._for_wq_config = True
@@ -308,6 +588,17 @@ class ModelSerializer(
         return [(True, "Yes"), (False, "No")]
 
     def get_wq_config(self):
+        memo = getattr(self.router, "_wq_config_memo", None)
+        # Config is built without a request, so only per-instance
+        # wq_config overrides can make it differ between instances
+        key = None if "wq_config" in vars(self) else type(self)
+        if memo is None or key is None:
+            return self.build_wq_config()
+        if key not in memo:
+            memo[key] = self.build_wq_config()
+        return copy.deepcopy(memo[key])
+
+    def build_wq_config(self):
         serializer_fields = self.get_fields_for_config()
         fields = []
         nested_fields = []
@@ -542,10 +833,7 @@ class ModelSerializer(
     def get_wq_foreignkey_info(self, model):
         if not self.router or not self.router.model_is_registered(model):
             return None
-        else:
-            serializer = self.router.get_serializer_for_model(model)
-            model_conf = serializer().get_wq_config()
-            return model_conf["name"]
+        return self.router._page_names[model]
 
     def to_representation(self, obj):
         data = super().to_representation(obj)
@@ -632,6 +920,56 @@ class ModelSerializer(
         return getattr(self, "_for_wq_config", False)
 
     def get_fields(self, *args, **kwargs):
+        with timing.phase("fields"):
+            key = self.get_field_cache_key()
+            cached = ModelSerializer._field_cache.get(key) if key else None
+            if cached:
+                fields, id_fields = cached
+                self.id_fields.update(id_fields)
+                return self.copy_fields(fields)
+
+            fields = self.build_fields(*args, **kwargs)
+            if key:
+                ModelSerializer._field_cache[key] = (
+                    self.copy_fields(fields),
+                    set(self.id_fields),
+                )
+            return fields
+
+    def get_field_cache_key(self):
+        router = self.router
+        if not self.cache_fields and not (
+            router and router.serializer_caches_fields(type(self))
+        ):
+            return None
+        return (
+            type(self),
+            router,
+            bool(self.is_detail),
+            bool(self.is_config),
+            bool(self.is_geojson),
+            bool(self.is_html),
+        )
+
+    def copy_fields(self, fields):
+        # Share the router rather than cloning it along with field kwargs
+        memo = {id(self.router): self.router}
+        copied = OrderedDict()
+        for name, field in fields.items():
+            copied[name] = copy.deepcopy(field, memo)
+            # Deep copies are reinitialized from the original arguments, so
+            # carry over any attributes changed after construction
+            attrs = vars(copied[name])
+            for attr, value in vars(field).items():
+                if attr not in attrs or attrs[attr] != value:
+                    attrs[attr] = copy.deepcopy(value, memo)
+        return copied
+
+    @classmethod
+    def clear_field_cache(cls):
+        ModelSerializer._field_cache.clear()
+
+    def build_fields(self, *args, **kwargs):
         fields = super().get_fields(*args, **kwargs)
         fields = self.update_id_fields(fields)
         fields.update(self.get_label_fields(fields))
@@ -750,7 +1088,7 @@ class ModelSerializer(
 
         exclude = getattr(self.Meta, "exclude", [])
         if "label" not in exclude and "label" not in default_fields:
-            fields["label"] = serializers.ReadOnlyField(source="__str__")
+            fields["label"] = LabelField()
 
         info = model_meta.get_field_info(self.Meta.model)
 
@@ -773,6 +1111,14 @@ class ModelSerializer(
 
         return fields
 
+    def get_natural_key_fields(self, model_class):
+        if not hasattr(model_class, "get_natural_key_def"):
+            return []
+        return [
+            model_class._meta.get_field(name)
+            for name in model_class.get_natural_key_def()
+        ]
+
     def get_nested_arrays(self, fields):
         model_class = self.Meta.model
         nested = {}
@@ -839,6 +1185,25 @@ class ModelSerializer(
 
         return Serializer
 
+    def optimize_queryset(self, queryset, nested=False, only=False):
+        """
+        Apply select_related() and prefetch_related() to queryset based on
+        the fields this serializer will actually output.  If only is set
+        (e.g. for list views), also restrict the loaded columns with only().
+        """
+        only = only and not nested
+        if only and queryset.query.deferred_loading[0]:
+            only = False
+        return apply_query_plan(queryset, self.get_query_plan(only))
+
+    def get_query_plan(self, only=False):
+        select_related, prefetch_related = get_related_plan(self)
+        if only:
+            only_fields = get_only_fields(self, select_related)
+        else:
+            only_fields = None
+        return (select_related, prefetch_related, only_fields)
+
     def build_relational_field(self, field_name, relation_info):
         if isinstance(relation_info.related_model, str):
             raise ImproperlyConfigured(
@@ -871,3 +1236,200 @@ class ModelSerializer(
         wq_fieldsets = None
         wq_nested_arrays = None
         list_serializer_class = ListSerializer
+
+
+def get_natural_key(model_class, values):
+    """
+    Flatten validated NaturalKeySerializer data into a natural key tuple
+    """
+    key = []
+    for field in model_class.get_natural_key_fields():
+        value = values
+        for part in field.split("__"):
+            value = value[part]
+        key.append(value)
+    return tuple(key)
+
+
+def resolve_natural_keys(model_class, keys, cache=None, chunk_size=100):
+    """
+    Get or create the objects for a list of natural keys.  Unknown keys are
+    looked up with one query per chunk of keys.  Any that are still missing
+    are created one at a time with get_or_create_by_natural_key(), so that
+    save() and model signals run as usual.  Results are stored in cache.
+    """
+    if cache is None:
+        cache = {}
+    fields = model_class.get_natural_key_fields()
+    related = [
+        "__".join(field.split("__")[:-1]) for field in fields if "__" in field
+    ]
+    missing = [
+        key for key in dict.fromkeys(keys) if (model_class, key) not in cache
+    ]
+
+    for start in range(0, len(missing), chunk_size):
+        end = start + chunk_size
+        query = models.Q()
+        for key in missing[start:end]:
+            query |= models.Q(**dict(zip(fields, key)))
+        queryset = model_class._default_manager.filter(query)
+        if related:
+            queryset = queryset.select_related(*related)
+        for obj in queryset:
+            cache[model_class, obj.natural_key()] = obj
+
+    manager = model_class._default_manager
+    for key in missing:
+        if (model_class, key) not in cache:
+            obj, is_new = manager.get_or_create_by_natural_key(*key)
+            cache[model_class, key] = obj
+
+    return [cache.get((model_class, key)) for key in keys]
+
+
+def can_bulk_insert(serializer):
+    """
+    Whether rows for a model serializer can be saved with bulk_create():
+    every writable field maps to a concrete column on the model (i.e. no
+    further nesting), and the database returns primary keys from bulk
+    inserts.
+    """
+    model_class = serializer.Meta.model
+    opts = model_class._meta
+    if opts.parents:
+        return False
+    db = db_router.db_for_write(model_class)
+    if not connections[db].features.can_return_rows_from_bulk_insert:
+        return False
+    columns = {f.name for f in opts.concrete_fields} | {
+        f.attname for f in opts.concrete_fields
+    }
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if field.source not in columns:
+            return False
+        if isinstance(field, serializers.BaseSerializer) and not isinstance(
+            field, NaturalKeySerializer
+        ):
+            return False
+    return True
+
+
+def get_attname_value(attrs, field):
+    value = attrs.get(field.name, attrs.get(field.attname))
+    if isinstance(value, models.Model):
+        value = value.pk
+    return value
+
+
+def get_source_field(model, field):
+    if not field.source_attrs:
+        return None
+    try:
+        return model._meta.get_field(field.source_attrs[0])
+    except FieldDoesNotExist:
+        return None
+
+
+def apply_query_plan(queryset, plan):
+    select_related, prefetch_related, only_fields = plan
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if only_fields:
+        queryset = queryset.only(*only_fields)
+    return queryset
+
+
+def get_related_plan(serializer, prefix=""):
+    """
+    Determine the select_related() and prefetch_related() paths needed to
+    serialize instances of serializer.Meta.model without extra queries.
+    """
+    model = serializer.Meta.model
+    select_related = []
+    prefetch_related = []
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, LabelField):
+            select_related += [
+                prefix + path for path in get_label_related(model)
+            ]
+            continue
+
+        source = get_source_field(model, field)
+        if source is None or not source.is_relation:
+            continue
+        path = prefix + source.name
+
+        if source.many_to_many or source.one_to_many:
+            if isinstance(field, serializers.ListSerializer) and isinstance(
+                field.child, ModelSerializer
+            ):
+                queryset = field.child.optimize_queryset(
+                    source.related_model._default_manager.all(),
+                    nested=True,
+                )
+                prefetch_related.append(models.Prefetch(path, queryset))
+            else:
+                prefetch_related.append(path)
+        elif isinstance(field, serializers.BaseSerializer):
+            select_related.append(path)
+            nested_select, nested_prefetch = get_related_plan(
+                field, path + "__"
+            )
+            select_related += nested_select
+            prefetch_related += nested_prefetch
+        elif isinstance(field, serializers.RelatedField):
+            if not field.use_pk_only_optimization():
+                select_related.append(path)
+        elif len(field.source_attrs) > 1:
+            select_related.append(path)
+
+    return (
+        list(OrderedDict.fromkeys(select_related)),
+        list(OrderedDict.fromkeys(prefetch_related)),
+    )
+
+
+def get_only_fields(serializer, select_related):
+    """
+    Determine the model fields needed by serializer, or None if that cannot
+    be determined (e.g. for SerializerMethodFields or custom __str__()).
+    """
+    model = serializer.Meta.model
+    only = [path.split("__")[0] for path in select_related]
+
+    def add_source(name):
+        try:
+            source = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if name.startswith("get_") and name.endswith("_display"):
+                return add_source(name[4:-8])
+            return False
+        if not source.concrete:
+            return source.is_relation
+        only.append(source.name)
+        return True
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, LabelField):
+            if not is_label_model(model):
+                return None
+            template = get_label_template(model.wq_label_template)
+            for key in get_template_keys(template):
+                if not add_source(key.split(".")[0]):
+                    return None
+        elif not field.source_attrs:
+            return None
+        elif not add_source(field.source_attrs[0]):
+            return None
+
+    return list(OrderedDict.fromkeys(only))
@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class SyncAppConfig(AppConfig):
+    name = "wq.db.rest.sync"
+    label = "wq_sync"
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.3 on 2026-10-18 21:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncCounter",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ModelChange",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=255)),
+                ("object_id", models.CharField(max_length=255)),
+                ("deleted", models.BooleanField(default=False)),
+                ("version", models.BigIntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["model", "version"], name="wq_sync_mod_model_023f9b_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="modelchange",
+            constraint=models.UniqueConstraint(
+                fields=("model", "object_id"), name="wq_sync_unique_object"
+            ),
+        ),
+    ]
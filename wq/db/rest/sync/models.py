@@ -0,0 +1,66 @@
+from django.db import models, transaction
+
+
+class ModelChange(models.Model):
+    """
+    Most recent change (save or delete) to each object in models registered
+    with sync=True.  The version doubles as the sync token for ?since=
+    requests.
+    """
+
+    model = models.CharField(max_length=255)
+    object_id = models.CharField(max_length=255)
+    deleted = models.BooleanField(default=False)
+    version = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "object_id"], name="wq_sync_unique_object"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["model", "version"]),
+        ]
+
+    def __str__(self):
+        return "%s %s" % (self.model, self.object_id)
+
+
+class SyncCounter(models.Model):
+    """
+    Single row holding the latest version number.  The row is locked while
+    a change is recorded, so versions are assigned (and committed) in order.
+    """
+
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+
+def record_change(model, object_id, deleted=False):
+    with transaction.atomic():
+        counter, created = (
+            SyncCounter.objects.select_for_update().get_or_create(pk=1)
+        )
+        counter.version += 1
+        counter.save(update_fields=["version"])
+        return ModelChange.objects.update_or_create(
+            model=model._meta.label_lower,
+            object_id=str(object_id),
+            defaults={"deleted": deleted, "version": counter.version},
+        )[0]
+
+
+def get_sync_token():
+    """
+    Latest committed version.  Writers hold the counter lock until they
+    commit, so every change up to this version is already visible.
+    """
+    return (
+        SyncCounter.objects.filter(pk=1)
+        .values_list("version", flat=True)
+        .first()
+        or 0
+    )
@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from collections import OrderedDict
+import threading
+import time
+
+
+# Sent once per timed request (after the response has been rendered or
+# streamed) with sender=view class, request, total, queries and phases.
+request_timed = Signal()
+
+_timer = ContextVar("wq_timer", default=None)
+_no_timer = nullcontext()
+
+
+def is_enabled():
+    return getattr(settings, "WQ_TIMING", False)
+
+
+def start_timer(view, request):
+    """
+    Start timing the request (if WQ_TIMING is enabled and the request is not
+    nested inside another timed request, e.g. for multi.json).
+    """
+    if not is_enabled():
+        return None
+    current = _timer.get()
+    if current is not None:
+        if not current.attached:
+            return None
+        # Previous response was never closed
+        current.finish()
+    timer = RequestTimer(view, request)
+    _timer.set(timer)
+    return timer
+
+
+def phase(name):
+    """
+    Context manager that records time (and SQL queries) spent in the named
+    phase of the current request.  A no-op unless a timer is active.
+    """
+    timer = _timer.get()
+    if timer is None:
+        return _no_timer
+    return timer.phase(name)
+
+
+def worker():
+    """
+    Context manager for worker threads (e.g. multi.json with
+    WQ_MULTI_MAX_WORKERS) running in a copy of the request context, so that
+    queries on the thread's own connections are counted.
+    """
+    timer = _timer.get()
+    if timer is None:
+        return _no_timer
+    return timer.track_connections()
+
+
+class RequestTimer:
+    def __init__(self, view, request):
+        self.view = view
+        self.request = getattr(request, "_request", request)
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.phases = OrderedDict()
+        self.attached = False
+        self.finished = False
+        # Phases may run concurrently in worker threads.  (Phase query
+        # counts then include queries from the other threads.)
+        self.lock = threading.Lock()
+        self.connections = list(connections.all())
+        for conn in self.connections:
+            conn.execute_wrappers.append(self.count_query)
+
+    def count_query(self, execute, sql, params, many, context):
+        with self.lock:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def track_connections(self):
+        # Connections are per thread, so worker threads need their own
+        # wrappers
+        conns = [
+            conn
+            for conn in connections.all()
+            if self.count_query not in conn.execute_wrappers
+        ]
+        for conn in conns:
+            conn.execute_wrappers.append(self.count_query)
+        try:
+            yield
+        finally:
+            for conn in conns:
+                conn.execute_wrappers.remove(self.count_query)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        queries = self.queries
+        try:
+            yield
+        finally:
+            with self.lock:
+                if name not in self.phases:
+                    self.phases[name] = {
+                        "duration": 0,
+                        "queries": 0,
+                        "calls": 0,
+                    }
+                info = self.phases[name]
+                info["duration"] += (time.perf_counter() - start) * 1000
+                info["queries"] += self.queries - queries
+                info["calls"] += 1
+
+    @property
+    def total(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def get_header(self):
+        metrics = [
+            ("total", {"duration": self.total, "queries": self.queries})
+        ] + list(self.phases.items())
+        return ", ".join(
+            '%s;dur=%.1f;desc="%s queries"'
+            % (name, info["duration"], info["queries"])
+            for name, info in metrics
+        )
+
+    def attach(self, response):
+        """
+        Add the Server-Timing header once the response is rendered.  The
+        timer itself runs until the response is closed, so that streamed
+        content is included in request_timed.
+        """
+        self.attached = True
+
+        def add_header(response):
+            response["Server-Timing"] = self.get_header()
+
+        if getattr(response, "is_rendered", True):
+            add_header(response)
+        else:
+            response.add_post_render_callback(add_header)
+        response._resource_closers.append(self.finish)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        for conn in self.connections:
+            if self.count_query in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self.count_query)
+        if _timer.get() is self:
+            _timer.set(None)
+        request_timed.send(
+            sender=self.view,
+            request=self.request,
+            total=self.total,
+            queries=self.queries,
+            phases=self.phases,
+        )
@@ -1,8 +1,22 @@
 from rest_framework.generics import GenericAPIView as RestGenericAPIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework import status, viewsets
-from django.db.models import ProtectedError
+from rest_framework.exceptions import (
+    ValidationError,
+    NotFound,
+    PermissionDenied,
+    NotAuthenticated,
+)
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import ProtectedError, QuerySet
+from django.http import StreamingHttpResponse
+from .renderers import GeoJSONRenderer
+from .permissions import has_perm
+from . import timing
+from collections import OrderedDict
 
 
 class GenericAPIView(RestGenericAPIView):
@@ -26,10 +40,40 @@ class GenericAPIView(RestGenericAPIView):
     def get_template_names(self):
         return [self.template_name]
 
+    def dispatch(self, request, *args, **kwargs):
+        timer = timing.start_timer(type(self), request)
+        if timer is None:
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            timer.finish()
+            raise
+        timer.attach(response)
+        return response
+
     def get_queryset(self):
-        if self.router is not None and self.model is not None:
-            return self.router.get_queryset_for_model(self.model, self.request)
-        return super(GenericAPIView, self).get_queryset()
+        if self.router is None or self.model is None:
+            return super(GenericAPIView, self).get_queryset()
+        with timing.phase("queryset"):
+            queryset = self.router.get_queryset_for_model(
+                self.model, self.request
+            )
+            if self.request.method in SAFE_METHODS:
+                # Only list views restrict columns, since detail views (and
+                # their templates) may read fields beyond the serializer's
+                queryset = self.router.optimize_queryset(
+                    queryset,
+                    self.get_serializer_class(),
+                    self.get_serializer_context(),
+                    only=getattr(self, "action", None) == "list",
+                    depth=self.depth,
+                )
+        return queryset
+
+    def filter_queryset(self, queryset):
+        with timing.phase("filter"):
+            return super().filter_queryset(queryset)
 
     def get_serializer_class(self):
         if self.router is not None and self.model is not None:
@@ -51,6 +95,8 @@ class SimpleViewSet(viewsets.ViewSet, GenericAPIView):
 
 
 class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
+    stream_chunk_size = 2000
+
     @property
     def template_name(self):
         basename = self.model._meta.model_name
@@ -99,6 +145,18 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
             return super(ModelViewSet, self).retrieve(request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
+        if self.router and len(set(self.kwargs) - {"format"}) > 0:
+            # Unknown parent (e.g. /parents/missing/children) is a 404
+            self.get_parent()
+
+        if "since" in request.GET and self.router:
+            conf = self.router.get_model_config(self.model) or {}
+            if conf.get("sync"):
+                return self.list_changes(request)
+
+        if self.should_stream(request):
+            return self.stream_list(request)
+
         response = super(ModelViewSet, self).list(request, *args, **kwargs)
         if not isinstance(response.data, dict):
             return response
@@ -111,6 +169,130 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
 
         return self.add_parent_info(request, response)
 
+    def list_changes(self, request):
+        """
+        Return only the objects changed (and the ids of objects deleted or
+        no longer in the cache filter) since the given sync token.
+        """
+        from .sync.models import ModelChange, get_sync_token
+
+        try:
+            since = int(request.GET["since"])
+        except ValueError:
+            raise ValidationError({"since": "Expected an integer"})
+
+        sync_token = get_sync_token()
+        changes = ModelChange.objects.filter(
+            model=self.model._meta.label_lower,
+            version__gt=since,
+            version__lte=sync_token,
+        ).values_list("object_id", "deleted")
+
+        lookup = self.router.get_lookup_for_model(self.model)
+        if lookup == "pk":
+            to_python = self.model._meta.pk.to_python
+        else:
+            to_python = self.model._meta.get_field(lookup).to_python
+        # Compare ids as strings, since serialized ids (e.g. UUIDs) may not
+        # compare equal to the corresponding Python values
+        changed = set()
+        deleted = set()
+        for object_id, is_deleted in changes:
+            if is_deleted:
+                deleted.add(object_id)
+            else:
+                changed.add(object_id)
+
+        queryset = self.router.get_cache_filter_for_model(self.model)(
+            self.filter_queryset(self.get_queryset()), request
+        ).filter(**{lookup + "__in": changed})
+        data = self.get_serializer(queryset, many=True).data
+        found = {str(obj["id"]) for obj in data}
+        deleted = {to_python(object_id) for object_id in deleted}
+        deleted |= {to_python(object_id) for object_id in changed - found}
+
+        return Response(
+            OrderedDict(
+                [
+                    ("since", since),
+                    ("sync_token", sync_token),
+                    ("list", data),
+                    ("deleted", sorted(deleted, key=str)),
+                ]
+            )
+        )
+
+    def should_stream(self, request):
+        """
+        Unpaged JSON lists for models with cache="all", "filter" or
+        "autoupdate" are streamed by default, as are GeoJSON lists for
+        models registered with stream=True.  Note for API consumers:
+        streamed responses have no Content-Length, no response.data (for
+        Python callers) and no conditional GET support.  Register a model
+        with stream=False to keep regular responses.
+        """
+        if not self.router:
+            return False
+        conf = self.router.get_model_config(self.model) or {}
+        stream = conf.get("stream")
+        renderer = request.accepted_renderer
+        if isinstance(renderer, GeoJSONRenderer):
+            return bool(stream)
+
+        # Stream cached JSON lists by default (unless stream=False)
+        if stream is False or self.paginator is None:
+            return False
+        if not hasattr(renderer, "render_stream"):
+            return False
+        if not hasattr(self.paginator, "get_cache_mode"):
+            return False
+        if not self.paginator.get_page_size(request):
+            return False
+        cache = self.paginator.get_cache_mode(self.model, request, self)
+        return cache in ("all", "filter", "autoupdate")
+
+    def stream_list(self, request):
+        """
+        Stream the list response one object at a time, rather than
+        serializing and rendering the entire page in memory.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        objs = None
+        if self.paginator is not None:
+            objs = self.paginator.paginate_queryset_stream(
+                queryset, request, view=self
+            )
+        if objs is None:
+            objs = queryset
+            response = Response({})
+        else:
+            response = self.get_paginated_response([])
+            if len(set(self.kwargs) - {"format"}) > 0:
+                response = self.add_parent_info(request, response)
+
+        renderer = request.accepted_renderer
+        return StreamingHttpResponse(
+            renderer.render_stream(
+                response.data,
+                self.stream_objects(objs),
+                request.accepted_media_type,
+                self.get_renderer_context(),
+            ),
+            content_type=renderer.media_type,
+        )
+
+    def stream_objects(self, queryset):
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.iterator(chunk_size=self.stream_chunk_size)
+        chunk = []
+        for obj in queryset:
+            chunk.append(obj)
+            if len(chunk) == self.stream_chunk_size:
+                yield from self.get_serializer(chunk, many=True).data
+                chunk = []
+        if chunk:
+            yield from self.get_serializer(chunk, many=True).data
+
     def create(self, request, *args, **kwargs):
         response = super(ModelViewSet, self).create(request, *args, **kwargs)
         if not request.accepted_media_type.startswith("text/html"):
@@ -135,6 +317,134 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
         else:
             return self.saveerror(request, response)
 
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create or update a list of records in a single transaction (e.g. to
+        sync an offline outbox).  Records with an id are updated, the rest
+        are created.  Results (the saved id, or errors) are returned in the
+        same order as the submitted records.
+        """
+        items = request.data
+        if isinstance(items, dict) and "list" in items:
+            items = items["list"]
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) for item in items
+        ):
+            raise ValidationError({"list": "Expected a list of objects"})
+
+        if self.router:
+            lookup = self.router.get_lookup_for_model(self.model)
+        else:
+            lookup = "pk"
+        if lookup == "pk":
+            lookup_field = self.model._meta.pk
+        else:
+            lookup_field = self.model._meta.get_field(lookup)
+
+        results = [None] * len(items)
+        ids = {}
+        for i, item in enumerate(items):
+            if not item.get("id"):
+                continue
+            try:
+                ids[i] = str(lookup_field.to_python(item["id"]))
+            except (DjangoValidationError, TypeError, ValueError):
+                results[i] = self.get_bulk_error(
+                    status.HTTP_404_NOT_FOUND, NotFound().detail
+                )
+
+        existing = {}
+        if ids:
+            queryset = self.filter_queryset(self.get_queryset())
+            for obj in queryset.filter(**{lookup + "__in": ids.values()}):
+                existing[str(getattr(obj, lookup))] = obj
+
+        creates = []
+        updates = []
+        can_add = has_perm(request.user, self.model, "add")
+        can_change = has_perm(request.user, self.model, "change")
+        for i, item in enumerate(items):
+            if results[i] is not None:
+                continue
+            elif not item.get("id"):
+                if can_add:
+                    creates.append(i)
+                else:
+                    results[i] = self.get_bulk_error(
+                        status.HTTP_403_FORBIDDEN, PermissionDenied().detail
+                    )
+            elif ids[i] not in existing:
+                results[i] = self.get_bulk_error(
+                    status.HTTP_404_NOT_FOUND, NotFound().detail
+                )
+            elif not can_change:
+                results[i] = self.get_bulk_error(
+                    status.HTTP_403_FORBIDDEN, PermissionDenied().detail
+                )
+            else:
+                try:
+                    obj = existing[ids[i]]
+                    self.check_object_permissions(request, obj)
+                except (PermissionDenied, NotAuthenticated) as e:
+                    results[i] = self.get_bulk_error(e.status_code, e.detail)
+                else:
+                    updates.append(i)
+
+        with transaction.atomic():
+            if creates:
+                serializer = self.get_serializer(
+                    data=[items[i] for i in creates], many=True
+                )
+                if not serializer.is_valid():
+                    for i, errors in zip(creates, serializer.errors):
+                        if errors:
+                            results[i] = self.get_bulk_error(
+                                status.HTTP_400_BAD_REQUEST, errors
+                            )
+                    creates = [i for i in creates if results[i] is None]
+                    serializer = self.get_serializer(
+                        data=[items[i] for i in creates], many=True
+                    )
+                    serializer.is_valid(raise_exception=True)
+                if creates:
+                    self.perform_create(serializer)
+                    for i, obj in zip(creates, serializer.instance):
+                        results[i] = {
+                            "id": getattr(obj, lookup),
+                            "status": status.HTTP_201_CREATED,
+                        }
+
+            for i in updates:
+                obj = existing[ids[i]]
+                serializer = self.get_serializer(obj, data=items[i])
+                if not serializer.is_valid():
+                    results[i] = self.get_bulk_error(
+                        status.HTTP_400_BAD_REQUEST, serializer.errors
+                    )
+                    continue
+                self.perform_update(serializer)
+                results[i] = {
+                    "id": getattr(serializer.instance, lookup),
+                    "status": status.HTTP_200_OK,
+                }
+
+        error_count = len([result for result in results if "errors" in result])
+        return Response(
+            OrderedDict(
+                [
+                    ("count", len(items)),
+                    ("errors", error_count),
+                    ("list", results),
+                ]
+            )
+        )
+
+    def get_bulk_error(self, status_code, errors):
+        if not isinstance(errors, dict):
+            errors = {"detail": errors}
+        return {"status": status_code, "errors": errors}
+
     def postsave(self, request, response):
         if self.router:
             conf = self.router.get_config_for_model(self.model)
@@ -198,7 +508,14 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
         else:
             return response
 
-    def add_parent_info(self, request, response):
+    def get_parent(self):
+        """
+        Look up the parent model and object for nested list routes, e.g.
+        /[parentmodel_url]/[foreignkey_value]/[model_url]
+        """
+        if hasattr(self, "_parent"):
+            return self._parent
+
         parent_model = None
         pid = None
         for rel_model, fields in self.router.get_foreign_keys(
@@ -208,12 +525,25 @@ class ModelViewSet(viewsets.ModelViewSet, GenericAPIView):
                 pid = self.kwargs[fields[0]]
                 parent_model = rel_model
 
-        if not parent_model:
+        parent = None
+        if parent_model:
+            try:
+                parent = self.router.get_by_identifier(
+                    self.router.get_queryset_for_model(
+                        parent_model, self.request
+                    ),
+                    pid,
+                )
+            except parent_model.DoesNotExist:
+                raise NotFound()
+        self._parent = parent_model, parent
+        return self._parent
+
+    def add_parent_info(self, request, response):
+        parent_model, parent = self.get_parent()
+        if parent is None:
             return response
 
-        parent = self.router.get_by_identifier(
-            self.router.get_queryset_for_model(parent_model, request), pid
-        )
         objid = self.router.get_object_id(parent)
         page_config = self.router.get_model_config(parent_model)
         urlbase = page_config["url"]